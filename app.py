@@ -1,24 +1,315 @@
-from flask import Flask, render_template, request
+import codecs
+import itertools
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, Response, render_template, request
 from flask_socketio import SocketIO, emit
-from ssh_utils import run_ssh_command
+
+import metrics
+import scrollback
+from ssh_utils import run_ssh_command, pool
 
 app = Flask(__name__)
-socketio = SocketIO(app)
+# asyncio-режима у Flask-SocketIO нет, а eventlet/gevent потребовали бы патчить paramiko,
+# поэтому остаёмся на потоках: обработчики событий только ставят задачу и сразу возвращаются,
+# а подключение и exec идут в ограниченном пуле потоков.
+socketio = SocketIO(app, async_mode='threading')
+
+SSH_WORKERS = 32       # одновременных блокирующих SSH-операций (подключение, exec)
+COMMAND_TIMEOUT = 60   # секунд на чтение вывода run_command
+ssh_executor = ThreadPoolExecutor(max_workers=SSH_WORKERS, thread_name_prefix='ssh')
+
+# Вывод PTY склеивается в один кадр не дольше FRAME_INTERVAL и не больше MAX_FRAME_BYTES,
+# чтобы браузер получал данные сразу, но без лавины мелких сообщений.
+FRAME_INTERVAL = 1 / 60
+MAX_FRAME_BYTES = 64 * 1024
+READ_CHUNK = 32 * 1024
+
+# Перезагруженная вкладка или оборванный socket.io не убивают shell сразу: сессия
+# отцепляется от клиента и ещё DETACH_GRACE секунд живёт, копя вывод в буфере прокрутки.
+# Клиент с тем же токеном (он хранится в sessionStorage вкладки) и теми же данными SSH
+# подцепляется обратно и получает последние REPLAY_BYTES вывода.
+DETACH_GRACE = 120
+REPLAY_BYTES = 64 * 1024
+
+
+# буфер прокрутки принадлежит конкретному shell, а не вкладке: с того же токена может
+# открыться новый shell (другие данные SSH), пока старый ещё не закрыт
+terminal_ids = itertools.count(1)
+
+
+def scrollback_key(terminal_id):
+    return f'web:{terminal_id}'
+
+
+def decode_replay(data, truncated):
+    text = data.decode('utf-8', errors='replace')
+    if truncated:
+        # начало хвоста могло разрезать символ или escape-последовательность — с новой строки
+        newline = text.find('\n')
+        if 0 <= newline < 4096:
+            text = text[newline + 1:]
+    return text
+
+
+class TerminalSession:
+    def __init__(self, sid, channel, token, creds):
+        self.sid = sid  # None, пока сессия отцеплена от клиента
+        self.channel = channel
+        self.token = token
+        self.creds = creds
+        self.key = scrollback_key(next(terminal_ids))
+        self.closed = False
+        self.detached_at = None
+        # под этим замком вывод пишется в буфер и отправляется клиенту, поэтому повтор
+        # хвоста при подключении не теряет и не дублирует кадры
+        self._lock = threading.Lock()
+
+    def start(self):
+        socketio.start_background_task(self._pump)
+
+    def _read_frame(self):
+        chan = self.channel
+        chan.settimeout(None)
+        data = chan.recv(READ_CHUNK)
+        if not data:
+            return None
+        frame = [data]
+        size = len(data)
+        deadline = time.monotonic() + FRAME_INTERVAL
+        while size < MAX_FRAME_BYTES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            chan.settimeout(remaining)
+            try:
+                data = chan.recv(READ_CHUNK)
+            except socket.timeout:
+                break
+            if not data:
+                break
+            frame.append(data)
+            size += len(data)
+        return b''.join(frame)
+
+    def _pump(self):
+        # UTF-8 символ может прийти разрезанным между двумя recv
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        try:
+            while not self.closed:
+                frame = self._read_frame()
+                if frame is None:
+                    break
+                with self._lock:
+                    if self.closed:
+                        break
+                    scrollback.store.write(self.key, frame)
+                    text = decoder.decode(frame)
+                    if self.sid is not None:
+                        socketio.emit('terminal_output', text, to=self.sid)
+        except (OSError, EOFError):
+            pass
+        finally:
+            if not self.closed and self.sid is not None:
+                socketio.emit('terminal_closed', to=self.sid)
+            release_terminal(self)
+
+    def attach(self, sid, cols, rows):
+        with self._lock:
+            start, total = scrollback.store.position(self.key)
+            data, first = scrollback.store.read(self.key, max(start, total - REPLAY_BYTES))
+            self.sid = sid
+            self.detached_at = None
+            socketio.emit('terminal_replay', decode_replay(data, first > 0), to=sid)
+        self.resize(cols, rows)
+
+    def detach(self):
+        with self._lock:
+            self.sid = None
+            self.detached_at = time.monotonic()
+
+    def write(self, data):
+        if self.closed:
+            return
+        try:
+            self.channel.sendall(data.encode())
+        except OSError:
+            self.close()
+
+    def resize(self, cols, rows):
+        if not self.closed:
+            try:
+                self.channel.resize_pty(width=cols, height=rows)
+            except OSError:
+                pass
+
+    def close(self):
+        self.closed = True
+        self.channel.close()
+
+
+# у каждого браузера свои данные SSH: они приходят в start_terminal и живут до отключения
+clients: dict[str, dict] = {}               # sid: {host, port, username, password}
+terminals: dict[str, TerminalSession] = {}  # sid: TerminalSession
+detached: dict[str, TerminalSession] = {}   # token: сессия, ждущая возвращения клиента
+clients_lock = threading.Lock()
+
+
+def parse_credentials(data):
+    host = str(data.get('host', '')).strip()
+    username = str(data.get('username', '')).strip()
+    if not host or not username:
+        raise ValueError('укажите хост и пользователя')
+    port = int(data.get('port') or 22)
+    return {'host': host, 'port': port, 'username': username, 'password': str(data.get('password', ''))}
+
+
+def release_terminal(session):
+    # shell завершился или закрыт насовсем — вместе с ним уходит и его буфер прокрутки
+    with clients_lock:
+        if terminals.get(session.sid) is session:
+            del terminals[session.sid]
+        if detached.get(session.token) is session:
+            del detached[session.token]
+    session.close()
+    scrollback.store.drop(session.key)
+
+
+def close_terminal(sid):
+    with clients_lock:
+        session = terminals.pop(sid, None)
+    if session:
+        release_terminal(session)
+
+
+def detach_terminal(sid):
+    with clients_lock:
+        session = terminals.pop(sid, None)
+        if session is None:
+            return
+        previous = detached.get(session.token)
+        detached[session.token] = session
+        session.detach()
+    if previous is not None and previous is not session:
+        release_terminal(previous)
+    timer = threading.Timer(DETACH_GRACE, expire_detached, args=(session,))
+    timer.daemon = True
+    timer.start()
+
+
+def expire_detached(session):
+    with clients_lock:
+        expired = detached.get(session.token) is session and session.sid is None
+    if expired:
+        release_terminal(session)
+
+
+def reattach_terminal(sid, token, creds, cols, rows):
+    # только тот же токен и те же данные SSH: токен сам по себе доступа к shell не даёт
+    with clients_lock:
+        session = detached.get(token)
+        if session is None or session.closed or session.creds != creds:
+            return False
+        del detached[token]
+        terminals[sid] = session
+    session.attach(sid, cols, rows)
+    socketio.emit('terminal_ready', to=sid)
+    return True
+
+
+def open_terminal(sid, token, creds, cols, rows):
+    # выполняется в ssh_executor: рукопожатие может занять секунды
+    try:
+        channel = pool.open_shell(
+            creds['host'], creds['port'], creds['username'], creds['password'], cols=cols, rows=rows,
+        )
+    except Exception as e:
+        socketio.emit('terminal_error', {'error': str(e)}, to=sid)
+        return
+    with clients_lock:
+        # пока шло подключение, клиент мог отключиться или подключиться заново
+        current = clients.get(sid) is creds
+        if current:
+            session = terminals[sid] = TerminalSession(sid, channel, token, creds)
+            # отцепленный shell этой вкладки (данные SSH не совпали) больше не вернуть
+            previous = detached.pop(token, None)
+    if not current:
+        channel.close()
+        return
+    if previous is not None:
+        release_terminal(previous)
+    session.start()
+    socketio.emit('terminal_ready', to=sid)
+
+
+def run_command(sid, creds, command):
+    try:
+        output, error = run_ssh_command(
+            host=creds['host'],
+            port=creds['port'],
+            username=creds['username'],
+            password=creds['password'],
+            command=command,
+            timeout=COMMAND_TIMEOUT,
+        )
+    except Exception as e:
+        output, error = '', str(e)
+    socketio.emit('command_result', {'output': output, 'error': error}, to=sid)
+
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.ENABLED:
+        return Response('метрики выключены, включите RCMU_METRICS=1\n', status=404, mimetype='text/plain')
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@socketio.on('start_terminal')
+def handle_start_terminal(data):
+    sid = request.sid
+    try:
+        creds = parse_credentials(data)
+        cols, rows = int(data.get('cols', 80)), int(data.get('rows', 24))
+    except (TypeError, ValueError) as e:
+        return emit('terminal_error', {'error': str(e)})
+    token = str(data.get('token') or sid)[:64]
+    close_terminal(sid)
+    with clients_lock:
+        clients[sid] = creds
+    if reattach_terminal(sid, token, creds, cols, rows):
+        return
+    ssh_executor.submit(open_terminal, sid, token, creds, cols, rows)
+
+@socketio.on('terminal_input')
+def handle_terminal_input(data):
+    session = terminals.get(request.sid)
+    if session:
+        session.write(data.get('data', ''))
+
+@socketio.on('resize')
+def handle_resize(data):
+    session = terminals.get(request.sid)
+    if session:
+        session.resize(int(data.get('cols', 80)), int(data.get('rows', 24)))
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    with clients_lock:
+        clients.pop(request.sid, None)
+    detach_terminal(request.sid)
+
 @socketio.on('run_command')
 def handle_run_command(data):
-    command = data.get('command')
-    output, error = run_ssh_command(
-        host='your.vds.ip',
-        username='your_username',
-        password='your_password',
-        command=command
-    )
-    emit('command_result', {'output': output, 'error': error})
+    creds = clients.get(request.sid)
+    if not creds:
+        return emit('command_result', {'output': '', 'error': 'нет SSH-подключения'})
+    ssh_executor.submit(run_command, request.sid, creds, data.get('command'))
 
 if __name__ == '__main__':
     socketio.run(app, debug=True)
@@ -0,0 +1,114 @@
+# Микробенчмарк очистки вывода терминала: пропускная способность (МБ/с)
+# потокового TerminalSanitizer против прежней пары re.sub из bot/telegram_bot.py.
+#
+#   python benchmarks/bench_sanitizer.py                  # синтетический вывод
+#   python benchmarks/bench_sanitizer.py capture.log ...  # реальные записанные сессии
+#   python benchmarks/bench_sanitizer.py --json
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bot"))
+
+from term_sanitizer import TerminalSanitizer  # noqa: E402
+
+
+def legacy_clean(output):
+    # прежний вариант, один в один как было в обработчиках
+    output = re.sub(r'\x1B\].*?(?:\x07|\x1B\\)', '', output)
+    return re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', output)
+
+
+def synthetic_capture(size_mb, seed=0):
+    rnd = random.Random(seed)
+    words = ["build", "src/main.c", "warning:", "error", "OK", "drwxr-xr-x", "root", "4096", "log"]
+    parts = []
+    total = 0
+    while total < size_mb * 1024 * 1024:
+        kind = rnd.random()
+        if kind < 0.5:
+            # цветной вывод ls / компилятора
+            line = " ".join(
+                f"\x1b[{rnd.choice((0, 1, 31, 32, 34))}m{rnd.choice(words)}\x1b[0m" for _ in range(8)
+            ) + "\r\n"
+        elif kind < 0.6:
+            # приглашение с OSC-заголовком
+            line = "\x1b]0;user@host: ~/project\x07\x1b[01;32muser@host\x1b[0m:\x1b[01;34m~\x1b[0m$ \r\n"
+        elif kind < 0.7:
+            # прогресс-бар, переписываемый через \r
+            line = "".join(f"\rprogress {p:3d}%" for p in range(0, 101, 10)) + "\r\n"
+        else:
+            line = " ".join(rnd.choice(words) for _ in range(12)) + "\r\n"
+        parts.append(line)
+        total += len(line)
+    return "".join(parts)
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def bench(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_case(name, text, repeat, chunk_sizes):
+    mb = len(text.encode()) / (1024 * 1024)
+    results = {"name": name, "size_mb": round(mb, 3), "throughput_mb_s": {}}
+
+    def streaming(size):
+        chunks = chunked(text, size)
+
+        def run():
+            sanitizer = TerminalSanitizer()
+            for chunk in chunks:
+                sanitizer.feed(chunk)
+            sanitizer.flush()
+        return run
+
+    cases = {"legacy_re_sub_whole": lambda: legacy_clean(text)}
+    for size in chunk_sizes:
+        legacy_chunks = chunked(text, size)
+        cases[f"legacy_re_sub_chunk_{size}"] = lambda c=legacy_chunks: [legacy_clean(x) for x in c]
+        cases[f"sanitizer_chunk_{size}"] = streaming(size)
+    cases["sanitizer_whole"] = lambda: TerminalSanitizer().clean(text)
+
+    for case, fn in cases.items():
+        results["throughput_mb_s"][case] = round(mb / bench(fn, repeat), 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="*", help="файлы с записанным выводом терминала")
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1024, 65536])
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    inputs = [(p, Path(p).read_text(errors="replace")) for p in args.captures]
+    if not inputs:
+        inputs = [(f"synthetic_{args.size_mb:g}mb", synthetic_capture(args.size_mb))]
+
+    report = [run_case(name, text, args.repeat, args.chunks) for name, text in inputs]
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    for case in report:
+        print(f"{case['name']} ({case['size_mb']} МБ)")
+        for name, value in case["throughput_mb_s"].items():
+            print(f"  {name:<32} {value:>9.2f} МБ/с")
+
+
+if __name__ == "__main__":
+    main()
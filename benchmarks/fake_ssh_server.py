@@ -0,0 +1,121 @@
+# Локальная замена SSH-сервера для бенчмарков: asyncssh-сервер на 127.0.0.1, у которого
+# «shell» — это обычный bash на этой же машине, exec — bash -c, а SFTP — файловая система.
+# Сервер крутится в своём потоке со своим циклом событий, так что к нему одинаково
+# подключаются и paramiko (веб-часть), и asyncssh (бот).
+import asyncio
+import threading
+
+import asyncssh
+
+USERNAME = "bench"
+PASSWORD = "bench"
+READ_CHUNK = 65536
+
+
+class _BenchServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return username == USERNAME and password == PASSWORD
+
+
+async def _read_input(process):
+    while True:
+        try:
+            return await process.stdin.read(READ_CHUNK)
+        except (asyncssh.TerminalSizeChanged, asyncssh.BreakReceived):
+            continue
+
+
+async def _handle_process(process, cwd):
+    # Без настоящего PTY: bash -i на каналах, без readline эха нет, а «stty» просто ругнётся
+    # в вывод, который ShellSession всё равно отбрасывает до первого маркера.
+    shell = process.command is None
+    args = ["bash", "--norc", "--noprofile", "--noediting", "-i"] if shell else ["bash", "-c", process.command]
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT if shell else asyncio.subprocess.PIPE,
+        cwd=cwd,
+        start_new_session=True,
+    )
+
+    async def pump_in():
+        while data := await _read_input(process):
+            proc.stdin.write(data)
+            await proc.stdin.drain()
+        proc.stdin.close()
+
+    async def pump_out(source, target):
+        while data := await source.read(READ_CHUNK):
+            target.write(data)
+            await target.drain()
+
+    feeder = asyncio.create_task(pump_in())
+    outputs = [pump_out(proc.stdout, process.stdout)]
+    if not shell:
+        outputs.append(pump_out(proc.stderr, process.stderr))
+    try:
+        await asyncio.gather(*outputs)
+        status = await proc.wait()
+    except (asyncssh.Error, ConnectionError, BrokenPipeError):
+        status = 255
+    finally:
+        feeder.cancel()
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+    process.exit(status)
+
+
+class FakeSSHServer:
+    def __init__(self, cwd: str, host: str = "127.0.0.1"):
+        self.cwd = cwd
+        self.host = host
+        self.port = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-ssh", daemon=True)
+        self._server = None
+
+    @property
+    def credentials(self) -> dict:
+        return {"host": self.host, "port": self.port, "username": USERNAME, "password": PASSWORD}
+
+    async def _start(self):
+        host_key = asyncssh.generate_private_key("ssh-ed25519")
+        self._server = await asyncssh.create_server(
+            _BenchServer,
+            self.host,
+            0,
+            server_host_keys=[host_key],
+            process_factory=lambda process: _handle_process(process, self.cwd),
+            sftp_factory=asyncssh.SFTPServer,
+            encoding=None,
+            allow_scp=False,
+        )
+        return self._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        self._thread.start()
+        self.port = asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,390 @@
+# Нагрузочный прогон обоих фронтендов против локального SSH-сервера (fake_ssh_server.py):
+#   - веб: ssh_utils.run_ssh_command и путь Socket.IO run_command через test_client;
+#   - бот: настоящие хендлеры aiogram через dp.feed_update, Bot API подменён сессией в памяти.
+# Снимаются перцентили времени «команда → ответ», время поднятия сессии, скорость передачи
+# файлов разного размера и поведение при N одновременных пользователях.
+#
+#   python benchmarks/load_test.py                      # сводка в консоль
+#   python benchmarks/load_test.py --json > run.json    # для сравнения между прогонами
+#   python benchmarks/load_test.py --users 1 10 50 --sizes-mb 0.1 1 8
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "bot"))
+sys.path.insert(0, str(ROOT))
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import GetFile, SendDocument, SendMediaGroup  # noqa: E402
+from aiogram.types import CallbackQuery, Chat, Document, File, Message, Update, User  # noqa: E402
+
+import metrics  # noqa: E402
+from fake_ssh_server import FakeSSHServer  # noqa: E402
+
+# telegram_bot импортирует токен из botToken.py, которого в репозитории нет
+sys.modules.setdefault("botToken", types.SimpleNamespace(TOKEN="123456:" + "B" * 35))
+
+COMMAND = "seq 1 200"
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+        "p50_ms": round(pick(0.50) * 1000, 2),
+        "p90_ms": round(pick(0.90) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def mb_per_s(size: int, seconds: float) -> float:
+    return round(size / (1024 * 1024) / max(seconds, 1e-9), 2)
+
+
+# ======== Веб-часть ========
+def bench_run_ssh_command(creds: dict, repeat: int, users: list[int]) -> dict:
+    from ssh_utils import pool, run_ssh_command
+
+    def once() -> float:
+        started = time.perf_counter()
+        output, error = run_ssh_command(
+            creds["host"], creds["username"], creds["password"], COMMAND, port=creds["port"],
+        )
+        if error or not output:
+            raise RuntimeError(f"run_ssh_command: {error!r}")
+        return time.perf_counter() - started
+
+    pool.close_all()
+    started = time.perf_counter()
+    once()
+    cold = time.perf_counter() - started
+    result = {"cold_ms": round(cold * 1000, 2), "sequential": percentiles([once() for _ in range(repeat)])}
+    result["concurrent"] = []
+    for n in users:
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            started = time.perf_counter()
+            samples = list(executor.map(lambda _: once(), range(n * repeat)))
+            wall = time.perf_counter() - started
+        result["concurrent"].append({
+            "clients": n, "wall_s": round(wall, 3),
+            "commands_per_s": round(len(samples) / wall, 1), "latency": percentiles(samples),
+        })
+    pool.close_all()
+    return result
+
+
+def _wait_event(client, name: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for packet in client.get_received():
+            if packet["name"] == name:
+                return packet["args"]
+            if packet["name"] == "terminal_error":
+                raise RuntimeError(packet["args"])
+        time.sleep(0.001)
+    raise TimeoutError(name)
+
+
+def bench_socketio(creds: dict, repeat: int, users: list[int]) -> dict:
+    import app as web
+
+    def client_run() -> tuple[float, list[float]]:
+        client = web.socketio.test_client(web.app)
+        try:
+            started = time.perf_counter()
+            client.emit("start_terminal", {**creds, "cols": 80, "rows": 24})
+            _wait_event(client, "terminal_ready")
+            setup = time.perf_counter() - started
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                client.emit("run_command", {"command": COMMAND})
+                _wait_event(client, "command_result")
+                samples.append(time.perf_counter() - started)
+            return setup, samples
+        finally:
+            client.disconnect()
+
+    result = []
+    for n in users:
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            started = time.perf_counter()
+            runs = list(executor.map(lambda _: client_run(), range(n)))
+            wall = time.perf_counter() - started
+        samples = [s for _, run in runs for s in run]
+        result.append({
+            "clients": n, "wall_s": round(wall, 3),
+            "commands_per_s": round(len(samples) / wall, 1),
+            "session_setup": percentiles([setup for setup, _ in runs]),
+            "latency": percentiles(samples),
+        })
+    return {"run_command": result}
+
+
+# ======== Бот ========
+# Bot API в памяти: отвечает правдоподобными объектами, вычитывает все отправляемые
+# файлы (так меряется реальный поток SFTP → Telegram) и отдаёт «загруженные» пользователем.
+class FakeTelegramSession(BaseSession):
+    def __init__(self):
+        super().__init__()
+        self.files: dict[str, bytes] = {}
+        self.received: dict[str, int] = {}
+        self.calls: dict[str, int] = {}
+        self._ids = itertools.count(1)
+
+    def _message(self, bot, chat_id, text=None) -> Message:
+        chat_id = chat_id if isinstance(chat_id, int) else 0
+        return Message(
+            message_id=next(self._ids), date=datetime.now(),
+            chat=Chat(id=chat_id, type="private"), text=text,
+        ).as_(bot)
+
+    async def _consume(self, bot, input_file) -> int:
+        size = 0
+        async for chunk in input_file.read(bot):
+            size += len(chunk)
+        self.received[input_file.filename] = size
+        return size
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if isinstance(method, GetFile):
+            data = self.files[method.file_id]
+            return File(file_id=method.file_id, file_unique_id=method.file_id,
+                        file_size=len(data), file_path=method.file_id)
+        if isinstance(method, SendDocument):
+            if isinstance(method.document, str):
+                # повторная отправка по file_id — Telegram ничего не передаёт
+                file_id = method.document
+            else:
+                await self._consume(bot, method.document)
+                file_id = f"sent-{next(self._ids)}"
+            message = self._message(bot, method.chat_id)
+            return message.model_copy(update={"document": Document(file_id=file_id, file_unique_id=file_id)})
+        if isinstance(method, SendMediaGroup):
+            for media in method.media:
+                await self._consume(bot, media.media)
+            return [self._message(bot, method.chat_id) for _ in method.media]
+        if hasattr(method, "text"):
+            return self._message(bot, getattr(method, "chat_id", None), method.text)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        data = self.files[url.rsplit("/", 1)[-1]]
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+    async def close(self):
+        pass
+
+
+class BotDriver:
+    def __init__(self, tb, creds: dict):
+        self.tb = tb
+        self.creds = creds
+        self.session = FakeTelegramSession()
+        tb.bot.session = self.session
+        if metrics.ENABLED:
+            self.session.middleware(tb.telegram_request_metrics)
+        self._update_ids = itertools.count(1)
+        self._done: dict[int, asyncio.Queue] = {}
+        # узнаём о завершении команды из очереди: хендлер сам по себе возвращается сразу
+        run_and_reply = tb.run_and_reply
+
+        async def traced(message, uid, session, cmd):
+            try:
+                await run_and_reply(message, uid, session, cmd)
+            finally:
+                self._done.setdefault(uid, asyncio.Queue()).put_nowait(time.perf_counter())
+
+        tb.run_and_reply = traced
+
+    def _message(self, uid: int, text: str | None = None, document: Document | None = None) -> Message:
+        return Message(
+            message_id=next(self._update_ids), date=datetime.now(),
+            chat=Chat(id=uid, type="private"),
+            from_user=User(id=uid, is_bot=False, first_name=f"user{uid}"),
+            text=text, document=document,
+        )
+
+    async def send(self, uid: int, text: str | None = None, document: Document | None = None):
+        update = Update(update_id=next(self._update_ids), message=self._message(uid, text, document))
+        await self.tb.dp.feed_update(self.tb.bot, update)
+
+    async def press(self, uid: int, data: str):
+        callback = CallbackQuery(
+            id=str(next(self._update_ids)), from_user=User(id=uid, is_bot=False, first_name=f"user{uid}"),
+            chat_instance="bench", data=data, message=self._message(uid, "…"),
+        )
+        await self.tb.dp.feed_update(self.tb.bot, Update(update_id=next(self._update_ids), callback_query=callback))
+
+    async def login(self, uid: int) -> float:
+        # тот же путь, что у человека: /start → «Изменить» → данные → «Сессия»
+        await self.send(uid, "/start")
+        await self.press(uid, "edit_data")
+        c = self.creds
+        await self.send(uid, f"{c['host']},{c['port']},{c['username']},{c['password']}")
+        started = time.perf_counter()
+        await self.send(uid, "Сессия: Выкл⛔")
+        if not self.tb.user_data[uid].get("input_mode"):
+            raise RuntimeError(f"сессия user{uid} не поднялась")
+        return time.perf_counter() - started
+
+    async def command(self, uid: int, cmd: str = COMMAND) -> float:
+        done = self._done.setdefault(uid, asyncio.Queue())
+        started = time.perf_counter()
+        await self.send(uid, cmd)
+        return await asyncio.wait_for(done.get(), 60) - started
+
+    async def logout(self, uid: int):
+        await self.send(uid, "Сессия: Вкл✅")
+
+
+async def bench_bot(creds: dict, workdir: str, repeat: int, users: list[int], sizes_mb: list[float]) -> dict:
+    import telegram_bot as tb
+
+    driver = BotDriver(tb, creds)
+    result = {"concurrent": [], "transfers": []}
+    uid_base = itertools.count(1000)
+
+    for n in users:
+        uids = [next(uid_base) for _ in range(n)]
+        started = time.perf_counter()
+        setups = await asyncio.gather(*(driver.login(uid) for uid in uids))
+
+        async def user_run(uid: int) -> list[float]:
+            return [await driver.command(uid) for _ in range(repeat)]
+
+        runs = await asyncio.gather(*(user_run(uid) for uid in uids))
+        wall = time.perf_counter() - started
+        samples = [s for run in runs for s in run]
+        result["concurrent"].append({
+            "users": n, "wall_s": round(wall, 3),
+            "commands_per_s": round(len(samples) / wall, 1),
+            "session_setup": percentiles(list(setups)),
+            "latency": percentiles(samples),
+            "ssh": tb.ssh_mux.stats(),
+        })
+        await asyncio.gather(*(driver.logout(uid) for uid in uids))
+
+    uid = next(uid_base)
+    await driver.login(uid)
+    for size_mb in sizes_mb:
+        size = int(size_mb * 1024 * 1024)
+        name = f"bench_{size}.bin"
+        driver.session.files[name] = os.urandom(size)
+        remote = Path(workdir) / name
+        remote.unlink(missing_ok=True)
+
+        await driver.send(uid, "Загрузить в текущ. директорию")
+        started = time.perf_counter()
+        await driver.send(uid, document=Document(file_id=name, file_unique_id=name, file_name=name, file_size=size))
+        upload = time.perf_counter() - started
+        if not remote.exists() or remote.stat().st_size != size:
+            raise RuntimeError(f"загрузка {name} не дошла до сервера")
+
+        await driver.send(uid, "Скачать из текущ. директории")
+        started = time.perf_counter()
+        await driver.send(uid, name)
+        download = time.perf_counter() - started
+        if driver.session.received.get(name) != size:
+            raise RuntimeError(f"скачивание {name}: получено {driver.session.received.get(name)} байт")
+        remote.unlink()
+        result["transfers"].append({
+            "size_mb": size_mb,
+            "upload_mb_s": mb_per_s(size, upload),
+            "download_mb_s": mb_per_s(size, download),
+        })
+    await driver.logout(uid)
+    result["bot_api_calls"] = dict(sorted(driver.session.calls.items()))
+    await tb.active_sessions.close_all()
+    await tb.ssh_mux.close_all()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20, help="команд на пользователя")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[0.1, 1, 8])
+    parser.add_argument("--skip", choices=("web", "socketio", "bot"), nargs="*", default=[])
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "command": COMMAND,
+            "repeat": args.repeat,
+            "users": args.users,
+        },
+    }
+    with tempfile.TemporaryDirectory(prefix="rcmu-bench-") as workdir, FakeSSHServer(workdir) as server:
+        creds = server.credentials
+        if "web" not in args.skip:
+            report["run_ssh_command"] = bench_run_ssh_command(creds, args.repeat, args.users)
+        if "socketio" not in args.skip:
+            report["socketio"] = bench_socketio(creds, args.repeat, args.users)
+        if "bot" not in args.skip:
+            report["bot"] = asyncio.run(bench_bot(creds, workdir, args.repeat, args.users, args.sizes_mb))
+    if metrics.ENABLED:
+        # RCMU_METRICS=1: заодно видно, где именно ушло время
+        report["metrics"] = metrics.render()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print_summary(report)
+
+
+def print_summary(report: dict):
+    def latency(stats: dict) -> str:
+        if not stats.get("n"):
+            return "—"
+        return f"p50 {stats['p50_ms']} мс, p90 {stats['p90_ms']} мс, p99 {stats['p99_ms']} мс"
+
+    if "run_ssh_command" in report:
+        web = report["run_ssh_command"]
+        print(f"run_ssh_command: холодный {web['cold_ms']} мс, подряд: {latency(web['sequential'])}")
+        for row in web["concurrent"]:
+            print(f"  {row['clients']:>4} клиентов: {row['commands_per_s']:>7} ком/с, {latency(row['latency'])}")
+    if "socketio" in report:
+        print("Socket.IO run_command:")
+        for row in report["socketio"]["run_command"]:
+            print(f"  {row['clients']:>4} клиентов: {row['commands_per_s']:>7} ком/с, {latency(row['latency'])}, "
+                  f"подключение {latency(row['session_setup'])}")
+    if "bot" in report:
+        print("Бот:")
+        for row in report["bot"]["concurrent"]:
+            print(f"  {row['users']:>4} польз.: {row['commands_per_s']:>7} ком/с, {latency(row['latency'])}, "
+                  f"сессия {latency(row['session_setup'])}, SSH-соединений {row['ssh']['handshakes_total']}")
+        for row in report["bot"]["transfers"]:
+            print(f"  файл {row['size_mb']:g} МБ: загрузка {row['upload_mb_s']} МБ/с, "
+                  f"скачивание {row['download_mb_s']} МБ/с")
+
+
+if __name__ == "__main__":
+    main()
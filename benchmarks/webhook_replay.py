@@ -0,0 +1,267 @@
+# Прогон webhook-режима (bot/webhook.py) без Telegram: приёмник и настоящие процессы-воркеры
+# поднимаются локально, Bot API подменён заглушкой на aiohttp (RCMU_TELEGRAM_API), а
+# синтетические обновления шлются в приёмник с заданной частотой, как их слал бы Telegram.
+# Снимаются: сколько обновлений в секунду принимается, задержка приёма и полного пути
+# «обновление → ответ бота в Bot API», равномерность распределения пользователей и то, что
+# каждый пользователь обслуживался ровно одним воркером.
+#
+#   python benchmarks/webhook_replay.py                          # 1, 2 и 4 воркера
+#   python benchmarks/webhook_replay.py --workers 4 --rate 2000 --users 500 --updates 20000
+#   python benchmarks/webhook_replay.py --json > webhook.json
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import re
+import signal
+import socket
+import sys
+import time
+import types
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "bot"))
+sys.path.insert(0, str(ROOT))
+
+from aiohttp import ClientSession, TCPConnector, web  # noqa: E402
+
+import webhook  # noqa: E402
+from load_test import percentiles  # noqa: E402
+
+TOKEN = "123456:" + "B" * 35
+SECRET = "replay-secret"
+REPLY_RE = re.compile(r"Таймаут команды: (\S+) с")
+
+
+def worker(index: int, host: str, port: int):
+    # процесс воркера: токена в репозитории нет, Bot API — заглушка из RCMU_TELEGRAM_API
+    sys.modules.setdefault("botToken", types.SimpleNamespace(TOKEN=TOKEN))
+    webhook.run_worker(index, host, port)
+
+
+def ingress(workers: int, port: int, base_port: int):
+    # приёмник — в своём процессе, как в бою: генератор нагрузки и заглушка Bot API
+    # не отнимают у него цикл событий
+    async def run():
+        server = webhook.Ingress(
+            workers=workers, host="127.0.0.1", port=port, base_port=base_port,
+            secret=SECRET, worker_target=worker,
+        )
+        await server.start()
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def free_ports(count: int) -> int:
+    # первый порт из count подряд свободных
+    for base in range(21000, 60000, count + 1):
+        sockets = []
+        try:
+            for port in range(base, base + count):
+                s = socket.socket()
+                sockets.append(s)
+                s.bind(("127.0.0.1", port))
+            return base
+        except OSError:
+            continue
+        finally:
+            for s in sockets:
+                s.close()
+    raise RuntimeError("нет свободных портов")
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.calls: dict[str, int] = {}
+        self.replies: dict[int, float] = {}  # номер обновления: когда пришёл ответ
+        self.other_replies = 0
+        self._ids = itertools.count(1)
+        self._runner = None
+        self.base = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        fields = await request.post()
+        if method.lower() != "sendmessage":
+            return web.json_response({"ok": True, "result": True})
+        text = str(fields.get("text", ""))
+        m = REPLY_RE.search(text)
+        if m:
+            self.replies[int(float(m.group(1)))] = time.perf_counter()
+        else:
+            self.other_replies += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": next(self._ids), "date": int(time.time()), "text": text,
+            "chat": {"id": int(fields.get("chat_id", 0)), "type": "private"},
+        }})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        self.base = f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+def make_update(update_id: int, uid: int, text: str) -> bytes:
+    return json.dumps({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": f"user{uid}"},
+        },
+    }).encode()
+
+
+async def replay(workers: int, users: int, updates: int, rate: float, concurrency: int) -> dict:
+    api = FakeBotAPI()
+    await api.start()
+    os.environ["RCMU_TELEGRAM_API"] = api.base
+    port = free_ports(workers + 1)
+    process = multiprocessing.get_context("spawn").Process(target=ingress, args=(workers, port, port + 1))
+    started = time.perf_counter()
+    process.start()
+    base = f"http://127.0.0.1:{port}"
+    url = base + webhook.WEBHOOK_PATH
+    headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": SECRET}
+    uids = [100000 + i for i in range(users)]
+    update_ids = itertools.count(1)
+    sent_at: dict[int, float] = {}
+    accept: list[float] = []
+    failed = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def post(session: ClientSession, body: bytes):
+        nonlocal failed
+        async with slots:
+            t = time.perf_counter()
+            try:
+                async with session.post(url, data=body, headers=headers) as resp:
+                    if resp.status != 200:
+                        failed += 1
+            except Exception:
+                failed += 1
+            accept.append(time.perf_counter() - t)
+
+    try:
+        async with ClientSession(connector=TCPConnector(limit=0)) as session:
+            while True:
+                try:
+                    async with session.get(f"{base}/stats") as resp:
+                        if resp.status == 200:
+                            break
+                except OSError:
+                    pass
+                if not process.is_alive() or time.perf_counter() - started > 60:
+                    raise RuntimeError("приёмник не запустился")
+                await asyncio.sleep(0.1)
+            startup = time.perf_counter() - started
+
+            # /start каждого пользователя — до замера, дальше его /timeout уже обрабатываются
+            await asyncio.gather(*(post(session, make_update(next(update_ids), uid, "/start")) for uid in uids))
+            await asyncio.sleep(0.5)
+            accept.clear()
+
+            tasks = []
+            replay_started = time.perf_counter()
+            for seq in range(1, updates + 1):
+                if rate:
+                    delay = replay_started + (seq - 1) / rate - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                uid = uids[seq % users]
+                sent_at[seq] = time.perf_counter()
+                tasks.append(asyncio.create_task(post(session, make_update(next(update_ids), uid, f"/timeout {seq}"))))
+            await asyncio.gather(*tasks)
+            accepted_in = time.perf_counter() - replay_started
+
+            deadline = time.perf_counter() + 30
+            while len(api.replies) < updates and time.perf_counter() < deadline:
+                await asyncio.sleep(0.05)
+            finished_in = max(api.replies.values(), default=replay_started) - replay_started
+
+            async with session.get(f"{base}/stats") as resp:
+                stats = await resp.json()
+    finally:
+        process.terminate()
+        await asyncio.to_thread(process.join, 30)
+        await api.stop()
+
+    owners: dict[int, list[int]] = {}
+    for row in stats["workers"]:
+        for uid in row.get("users", []):
+            owners.setdefault(uid, []).append(row["worker"])
+    per_worker = [len(row.get("users", [])) for row in stats["workers"]]
+    e2e = [api.replies[seq] - sent_at[seq] for seq in sent_at if seq in api.replies]
+    return {
+        "workers": workers,
+        "startup_s": round(startup, 2),
+        "sent": updates,
+        "failed": failed,
+        "replies": len(e2e),
+        "lost": updates - len(e2e),
+        "accepted_per_s": round(updates / accepted_in, 1),
+        "handled_per_s": round(len(e2e) / max(finished_in, 1e-9), 1),
+        "accept": percentiles(accept),
+        "end_to_end": percentiles(e2e),
+        "users_per_worker": per_worker,
+        "updates_per_worker": [row.get("updates", 0) for row in stats["workers"]],
+        "rerouted": stats["rerouted"],
+        "affinity_violations": sum(1 for owner in owners.values() if len(owner) > 1),
+        "bot_api_calls": dict(sorted(api.calls.items())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=5000, help="обновлений на прогон")
+    parser.add_argument("--rate", type=float, default=0, help="обновлений в секунду, 0 — как можно быстрее")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременных запросов к приёмнику")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "users": args.users,
+            "updates": args.updates,
+            "rate": args.rate,
+        },
+        "runs": [asyncio.run(replay(n, args.users, args.updates, args.rate, args.concurrency)) for n in args.workers],
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    for row in report["runs"]:
+        e2e = row["end_to_end"]
+        print(
+            f"{row['workers']:>2} воркер(ов): приём {row['accepted_per_s']:>8} обн/с, обработка {row['handled_per_s']:>8} обн/с, "
+            f"ответ p50 {e2e.get('p50_ms')} мс, p99 {e2e.get('p99_ms')} мс, потеряно {row['lost']}, "
+            f"пользователей по воркерам {row['users_per_worker']}, нарушений привязки {row['affinity_violations']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import asyncio
+import shlex
+from typing import Awaitable, Callable
+
+import metrics
+from transfers import TELEGRAM_UPLOAD_LIMIT, TransferProgress
+
+READ_CHUNK = 256 * 1024
+# часть архива чуть меньше лимита Bot API, чтобы осталось место под multipart-обвязку
+PART_SIZE = TELEGRAM_UPLOAD_LIMIT - 1024 * 1024
+MAX_PARALLEL_UPLOADS = 2
+
+# codec: (команда сжатия с {level}, расширение, уровень по умолчанию)
+ARCHIVE_CODECS = {
+    "gzip": ("gzip -{level}", ".tar.gz", 6),
+    "zstd": ("zstd -q -T0 -{level}", ".tar.zst", 3),
+    "none": (None, ".tar", None),
+}
+ARCHIVE_LEVELS = {"gzip": range(1, 10), "zstd": range(1, 20)}
+# метка в stderr: tar в конвейере со сжатием завершился с ошибкой (код конвейера — код компрессора)
+TAR_FAILED = "rcmu: tar exit "
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_command(path: str, codec: str = "gzip", level: int | None = None, members=(".",)) -> str:
+    compressor, _, default_level = ARCHIVE_CODECS[codec]
+    if level not in ARCHIVE_LEVELS.get(codec, ()):
+        level = default_level
+    # tar пишет в stdout, сжатие — отдельным процессом в том же конвейере. PIPESTATUS и
+    # pipefail есть не во всех оболочках, поэтому код tar передаётся строкой в stderr
+    cmd = f"tar -cf - -C {shlex.quote(path)} -- {' '.join(shlex.quote(m) for m in members)}"
+    if compressor:
+        cmd = f"{{ {cmd} || echo \"{TAR_FAILED}$?\" >&2; }} | " + compressor.format(level=level)
+    return cmd
+
+
+def part_name(base: str, codec: str, index: int, multipart: bool) -> str:
+    name = base + ARCHIVE_CODECS[codec][1]
+    return f"{name}.{index:03d}" if multipart else name
+
+
+async def stream_archive(
+    conn,
+    path: str,
+    send_part: Callable[[str, bytes], Awaitable[None]],
+    codec: str = "gzip",
+    level: int | None = None,
+    members=(".",),
+    base_name: str = "directory",
+    part_size: int = PART_SIZE,
+    max_parallel: int = MAX_PARALLEL_UPLOADS,
+    progress: TransferProgress | None = None,
+) -> int:
+    # Вывод tar читается прямо из exec-канала и режется на части по part_size. Готовая часть
+    # сразу уходит в send_part, пока архив продолжает создаваться; одновременно отправляется
+    # не больше max_parallel частей, а пока они не ушли, чтение канала (и tar) приостанавливается.
+    # Возвращает число отправленных частей.
+    slots = asyncio.Semaphore(max_parallel)
+    uploads: list[asyncio.Task] = []
+    buffer = bytearray()
+    index = 0
+
+    async def upload(name: str, data: bytes):
+        try:
+            await send_part(name, data)
+        finally:
+            slots.release()
+
+    async def cut(data: bytes, multipart: bool):
+        nonlocal index
+        await slots.acquire()
+        index += 1
+        uploads.append(asyncio.create_task(upload(part_name(base_name, codec, index, multipart), data)))
+
+    with metrics.track(metrics.transfer_seconds, "archive", op="archive"):
+        command = archive_command(path, codec, level, members)
+        process = await conn.create_process(command, encoding=None)
+        stderr_task = asyncio.create_task(process.stderr.read())
+        try:
+            while chunk := await process.stdout.read(READ_CHUNK):
+                metrics.transfer_bytes.inc(len(chunk), op="archive")
+                if progress:
+                    progress.update(len(chunk))
+                buffer += chunk
+                # часть отрезается, только когда за ней точно есть ещё данные — тогда сразу
+                # известно, что архив многотомный и части нужны номера
+                while len(buffer) > part_size:
+                    await cut(bytes(buffer[:part_size]), True)
+                    del buffer[:part_size]
+                for task in uploads:
+                    if task.done() and task.exception():
+                        raise task.exception()
+            await process.wait()
+            stderr = (await stderr_task).decode(errors="replace").strip()
+            if process.exit_status or TAR_FAILED in stderr:
+                lines = [line for line in stderr.splitlines() if not line.startswith(TAR_FAILED)]
+                status = process.exit_status or stderr.rpartition(TAR_FAILED)[2]
+                raise ArchiveError("\n".join(lines) or f"код выхода {status}")
+            if buffer or not index:
+                await cut(bytes(buffer), index > 0)
+            buffer.clear()
+            await asyncio.gather(*uploads)
+        except BaseException:
+            for task in uploads:
+                task.cancel()
+            stderr_task.cancel()
+            process.close()
+            raise
+    return index
@@ -0,0 +1,69 @@
+import asyncio
+import contextlib
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from shell_session import ShellSession
+
+MAX_QUEUE_DEPTH = 5  # команд, ожидающих своей очереди (не считая выполняющейся)
+
+
+class QueueFull(Exception):
+    pass
+
+
+# Очередь команд одной сессии. Хендлер только ставит команду в очередь и сразу возвращается,
+# а выполняет их по одной фоновый обработчик — так вывод соседних команд не перемешивается,
+# а медленная команда одного пользователя не держит хендлеры остальных.
+class CommandQueue:
+    def __init__(
+        self,
+        session: ShellSession,
+        execute: Callable[[Any, str], Awaitable[None]],
+        max_depth: int = MAX_QUEUE_DEPTH,
+    ):
+        self.session = session
+        self.execute = execute
+        self.max_depth = max_depth
+        self.current: str | None = None
+        self._queue: deque[tuple[Any, str]] = deque()
+        self._worker: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def submit(self, message, command: str) -> int:
+        # возвращает, сколько команд выполнится раньше этой
+        if len(self._queue) >= self.max_depth:
+            raise QueueFull(f"в очереди уже {len(self._queue)} команд")
+        ahead = len(self._queue) + (self.current is not None)
+        self._queue.append((message, command))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._work())
+        return ahead
+
+    async def _work(self):
+        while self._queue:
+            message, command = self._queue.popleft()
+            self.current = command
+            try:
+                await self.execute(message, command)
+            except Exception as e:
+                # ошибка одной команды не должна останавливать очередь, но и теряться молча — тоже
+                logging.exception("команда %r завершилась ошибкой", command)
+                with contextlib.suppress(Exception):
+                    await message.answer(f"❌ Ошибка при выполнении команды: {e}")
+            finally:
+                self.current = None
+
+    def interrupt(self) -> tuple[bool, int]:
+        # Ctrl-C текущей команде и отмена всего, что ждёт за ней
+        dropped = len(self._queue)
+        self._queue.clear()
+        return self.session.interrupt(), dropped
+
+    def close(self):
+        self._queue.clear()
+        if self._worker and self._worker is not asyncio.current_task():
+            self._worker.cancel()
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+import asyncssh
+
+import metrics
+
+from ssh_mux import ConnectionMux
+from term_sanitizer import sanitize
+
+FANOUT_CONCURRENCY = 20  # одновременных подключений в одном fan-out
+FANOUT_TIMEOUT = 30.0    # секунд на хост: подключение + команда
+GROUP_PREVIEW = 1500     # символов вывода на группу одинаковых ответов
+
+
+@dataclass
+class HostResult:
+    host: str
+    exit_status: int | None
+    output: str
+    error: str | None
+    elapsed: float
+
+
+def host_label(host: dict) -> str:
+    port = str(host.get("port", "22"))
+    return host["ip"] if port == "22" else f"{host['ip']}:{port}"
+
+
+def parse_hosts(text: str) -> list[dict]:
+    # тот же формат, что и для основных данных: ip,port,username,password — через ; или с новой строки
+    hosts = []
+    for line in text.replace(";", "\n").splitlines():
+        if not line.strip():
+            continue
+        parts = [p.strip() for p in line.split(",")]
+        if len(parts) != 4:
+            raise ValueError(f"неверная строка: {line.strip()}")
+        ip, port, username, password = parts
+        int(port)
+        hosts.append({"ip": ip, "port": port, "username": username, "password": password})
+    return hosts
+
+
+async def _run(host: dict, command: str, mux: ConnectionMux | None = None):
+    # через мультиплексор повторный fan-out на те же хосты обходится без новых рукопожатий
+    credentials = host["ip"], int(host["port"]), host["username"], host["password"]
+    if mux is not None:
+        async with mux.channel(*credentials) as conn:
+            return await conn.run(command, check=False)
+    ip, port, username, password = credentials
+    async with asyncssh.connect(ip, port=port, username=username, password=password, known_hosts=None) as conn:
+        return await conn.run(command, check=False)
+
+
+async def run_on_host(host: dict, command: str, timeout: float, mux: ConnectionMux | None = None) -> HostResult:
+    started = time.monotonic()
+    label = host_label(host)
+    try:
+        with metrics.track(metrics.ssh_command_seconds, "fanout", frontend="bot", mode="fanout"):
+            result = await asyncio.wait_for(_run(host, command, mux), timeout)
+    except asyncio.TimeoutError:
+        return HostResult(label, None, "", f"таймаут {timeout:g} с", time.monotonic() - started)
+    except Exception as e:
+        return HostResult(label, None, "", str(e) or type(e).__name__, time.monotonic() - started)
+    output = sanitize(f"{result.stdout or ''}{result.stderr or ''}").strip()
+    return HostResult(label, result.exit_status, output, None, time.monotonic() - started)
+
+
+async def fanout(hosts: list[dict], command: str, concurrency: int = FANOUT_CONCURRENCY,
+                 timeout: float = FANOUT_TIMEOUT, mux: ConnectionMux | None = None) -> list[HostResult]:
+    # все хосты одновременно (в пределах concurrency), так что общее время ≈ самый медленный хост
+    slots = asyncio.Semaphore(concurrency)
+
+    async def limited(host: dict):
+        async with slots:
+            return await run_on_host(host, command, timeout, mux)
+
+    return await asyncio.gather(*(limited(host) for host in hosts))
+
+
+def format_summary(command: str, results: list[HostResult], wall_time: float) -> str:
+    ok = [r for r in results if r.error is None]
+    failed = [r for r in results if r.error is not None]
+
+    # одинаковые ответы (код выхода + вывод) показываем один раз со списком хостов
+    groups: dict[tuple[int | None, str], list[HostResult]] = {}
+    for r in ok:
+        groups.setdefault((r.exit_status, r.output), []).append(r)
+
+    lines = [
+        f"$ {command}",
+        f"Хостов: {len(results)}, успешно: {sum(1 for r in ok if r.exit_status == 0)}, "
+        f"ошибок: {len(failed) + sum(1 for r in ok if r.exit_status)}, "
+        f"время: {wall_time:.1f} с",
+    ]
+    for (status, output), members in sorted(groups.items(), key=lambda item: -len(item[1])):
+        mark = "✅" if status == 0 else "⚠️"
+        lines.append("")
+        lines.append(f"{mark} код {status} — {len(members)} хост(ов): {', '.join(r.host for r in members)}")
+        if output:
+            preview = output if len(output) <= GROUP_PREVIEW else output[:GROUP_PREVIEW] + "\n…"
+            lines.append(preview)
+    if failed:
+        lines.append("")
+        lines.append("❌ Не ответили:")
+        lines.extend(f"  {r.host}: {r.error}" for r in failed)
+
+    slowest = sorted(results, key=lambda r: r.elapsed, reverse=True)[:3]
+    if slowest:
+        lines.append("")
+        lines.append("🐢 Самые медленные: " + ", ".join(f"{r.host} ({r.elapsed:.1f} с)" for r in slowest))
+    return "\n".join(lines)
@@ -0,0 +1,281 @@
+import asyncio
+import html
+import posixpath
+import stat
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import asyncssh
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+import metrics
+from transfers import format_size
+
+BROWSER_PAGE_SIZE = 16        # файлов на странице (кнопок, по одной в ряд)
+LISTING_TTL = 30.0            # секунд, сколько листинг директории считается свежим
+LISTING_CACHE_ENTRIES = 200_000  # записей во всех закэшированных листингах одной сессии
+PREFETCH_DIRS = 3             # поддиректорий со страницы, листинг которых подгружается заранее
+NAME_LIMIT = 48               # символов имени на кнопке
+ENTRY_BYTES = 200             # примерно байт памяти на запись листинга (кортеж, имя, числа)
+
+listing_requests = metrics.counter(
+    "rcmu_listing_requests_total", "Directory listings served by the file browser", ("result",))
+
+
+class Entry(NamedTuple):
+    name: str
+    is_dir: bool
+    is_link: bool
+    size: int
+    mtime: int
+
+
+def _entry(name: asyncssh.SFTPName) -> Entry:
+    attrs = name.attrs
+    kind = attrs.type
+    if kind == asyncssh.FILEXFER_TYPE_UNKNOWN and attrs.permissions is not None:
+        kind = {stat.S_IFDIR: asyncssh.FILEXFER_TYPE_DIRECTORY, stat.S_IFLNK: asyncssh.FILEXFER_TYPE_SYMLINK}.get(
+            stat.S_IFMT(attrs.permissions), kind)
+    return Entry(
+        name=name.filename if isinstance(name.filename, str) else name.filename.decode(errors="replace"),
+        is_dir=kind == asyncssh.FILEXFER_TYPE_DIRECTORY,
+        is_link=kind == asyncssh.FILEXFER_TYPE_SYMLINK,
+        size=attrs.size or 0,
+        mtime=attrs.mtime or 0,
+    )
+
+
+# Кэш листингов одной SSH-сессии. Директория читается через SFTP readdir целиком один
+# раз (атрибуты приходят вместе с именами, stat на каждый файл не нужен), сортируется и
+# дальше страницы — это срезы готового списка. Запись живёт LISTING_TTL, её сбрасывают
+# явно после cd, загрузки и удаления; одновременные запросы одной директории (нажатие и
+# предзагрузка) ждут один и тот же readdir. Объём ограничен суммарным числом записей,
+# вытесняются давно не открывавшиеся директории.
+class ListingCache:
+    def __init__(self, session, ttl: float = LISTING_TTL, max_entries: int = LISTING_CACHE_ENTRIES):
+        self.session = session
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._listings: OrderedDict[str, tuple[float, list[Entry]]] = OrderedDict()
+        self._size = 0
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._generation = 0  # растёт при каждом сбросе: readdir, начатый раньше, в кэш не пишется
+        self._prefetch: set[asyncio.Task] = set()
+
+    def cached(self, path: str) -> list[Entry] | None:
+        item = self._listings.get(path)
+        if item is None or item[0] < time.monotonic():
+            return None
+        self._listings.move_to_end(path)
+        return item[1]
+
+    async def get(self, path: str) -> list[Entry]:
+        entries = self.cached(path)
+        if entries is not None:
+            listing_requests.inc(result="hit")
+            return entries
+        task = self._inflight.get(path)
+        if task is None:
+            listing_requests.inc(result="miss")
+            task = self._inflight[path] = asyncio.create_task(self._load(path))
+            task.add_done_callback(lambda t: self._inflight.get(path) is t and self._inflight.pop(path))
+        else:
+            listing_requests.inc(result="shared")
+        return await asyncio.shield(task)
+
+    async def _load(self, path: str) -> list[Entry]:
+        generation = self._generation
+        async with self.session.sftp_client() as sftp:
+            names = await sftp.readdir(path)
+        entries = sorted(
+            (_entry(n) for n in names if n.filename not in (".", "..", b".", b"..")),
+            key=lambda e: (not e.is_dir, e.name.lower(), e.name),
+        )
+        if generation == self._generation:
+            self._store(path, entries)
+        return entries
+
+    def _store(self, path: str, entries: list[Entry]):
+        self._drop(path)
+        self._listings[path] = (time.monotonic() + self.ttl, entries)
+        self._size += len(entries)
+        while self._size > self.max_entries and len(self._listings) > 1:
+            oldest = next(iter(self._listings))
+            self._drop(oldest)
+
+    def _drop(self, path: str):
+        item = self._listings.pop(path, None)
+        if item:
+            self._size -= len(item[1])
+
+    def invalidate(self, path: str):
+        path = posixpath.normpath(path)
+        self._generation += 1
+        self._drop(path)
+        self._inflight.pop(path, None)
+
+    def prefetch(self, paths: list[str]):
+        # фоном, по одной директории за раз, чтобы не занимать SFTP-канал запросами пачкой
+        paths = [p for p in paths if self.cached(p) is None and p not in self._inflight]
+        if not paths:
+            return
+
+        async def run():
+            for path in paths:
+                try:
+                    await self.get(path)
+                except Exception:
+                    pass  # нет прав, директорию удалили — откроется с ошибкой, когда её выберут
+
+        task = asyncio.create_task(run())
+        self._prefetch.add(task)
+        task.add_done_callback(self._prefetch.discard)
+
+    def memory_footprint(self) -> int:
+        return self._size * ENTRY_BYTES
+
+    def close(self):
+        for task in list(self._prefetch):
+            task.cancel()
+        self._listings.clear()
+        self._size = 0
+
+
+
+
+def _short(name: str) -> str:
+    return name if len(name) <= NAME_LIMIT else name[:NAME_LIMIT - 1] + "…"
+
+
+# Проводник по серверу в одном сообщении с inline-кнопками. В callback_data лежит только
+# номер записи в том листинге, который сейчас показан (лимит Telegram — 64 байта), поэтому
+# показанный список запоминается и нажатия разбираются по нему, даже если кэш обновился.
+# Рядом с номером — номер показа (view): он растёт при каждой смене списка, и кнопки со
+# старого сообщения или до перехода/обновления отклоняются, а не бьют по чужому файлу.
+class FileBrowser:
+    def __init__(self, session, path: str, page_size: int = BROWSER_PAGE_SIZE):
+        self.session = session
+        self.cache = ListingCache(session)
+        self.path = posixpath.normpath(path)
+        self.page = 0
+        self.page_size = page_size
+        self.entries: list[Entry] = []
+        self.selected: int | None = None  # номер записи, открытой карточкой файла
+        self.message: Message | None = None
+        self.view = 0
+
+    @property
+    def pages(self) -> int:
+        return max(1, -(-len(self.entries) // self.page_size))
+
+    def _button(self, text: str, action: str) -> InlineKeyboardButton:
+        return InlineKeyboardButton(text=text, callback_data=f"fb:{self.view}:{action}")
+
+    def is_current(self, view: int, message: Message) -> bool:
+        return view == self.view and self.message is not None and message.message_id == self.message.message_id
+
+    def child(self, entry: Entry) -> str:
+        return posixpath.join(self.path, entry.name)
+
+    async def open(self, path: str):
+        entries = await self.cache.get(posixpath.normpath(path))
+        self.path = posixpath.normpath(path)
+        self.entries = entries
+        self.page = 0
+        self.selected = None
+        self.view += 1
+
+    async def reload(self):
+        self.cache.invalidate(self.path)
+        page = self.page
+        await self.open(self.path)
+        self.page = min(page, self.pages - 1)
+
+    async def up(self):
+        await self.open(posixpath.dirname(self.path) or "/")
+
+    def turn(self, page: int):
+        self.page = max(0, min(page, self.pages - 1))
+        self.selected = None
+
+    def entry(self, index: int) -> Entry | None:
+        return self.entries[index] if 0 <= index < len(self.entries) else None
+
+    async def resolve(self, entry: Entry) -> bool:
+        # симлинк: директория это или файл, узнаём только по stat цели
+        if not entry.is_link:
+            return entry.is_dir
+        async with self.session.sftp_client() as sftp:
+            try:
+                return await sftp.isdir(self.child(entry))
+            except asyncssh.SFTPError:
+                return False
+
+    def render(self) -> tuple[str, InlineKeyboardMarkup]:
+        if self.selected is not None:
+            return self._render_file(self.selected)
+        start = self.page * self.page_size
+        shown = self.entries[start:start + self.page_size]
+        rows = []
+        for i, entry in enumerate(shown, start):
+            if entry.is_dir:
+                label = f"📁 {_short(entry.name)}/"
+            else:
+                icon = "🔗" if entry.is_link else "📄"
+                label = f"{icon} {_short(entry.name)} · {format_size(entry.size)}"
+            rows.append([self._button(label, f"o:{i}")])
+        if self.pages > 1:
+            rows.append([
+                self._button("⏮", "p:0"),
+                self._button("◀️", f"p:{self.page - 1}"),
+                self._button(f"{self.page + 1}/{self.pages}", "noop"),
+                self._button("▶️", f"p:{self.page + 1}"),
+                self._button("⏭", f"p:{self.pages - 1}"),
+            ])
+        rows.append([self._button("⬆️ Вверх", "up"), self._button("🔄", "r"), self._button("✖️ Закрыть", "x")])
+        dirs = sum(1 for e in self.entries if e.is_dir)
+        text = (
+            f"📂 <code>{html.escape(self.path)}</code>\n"
+            f"Директорий: {dirs}, файлов: {len(self.entries) - dirs}"
+        )
+        if not self.entries:
+            text += "\n\n(пусто)"
+        # следующий шаг пользователя почти наверняка — одна из первых поддиректорий страницы
+        self.cache.prefetch([self.child(e) for e in shown if e.is_dir][:PREFETCH_DIRS])
+        return text, InlineKeyboardMarkup(inline_keyboard=rows)
+
+    def _render_file(self, index: int) -> tuple[str, InlineKeyboardMarkup]:
+        entry = self.entries[index]
+        modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.mtime)) if entry.mtime else "—"
+        text = (
+            f"📄 <code>{html.escape(self.child(entry))}</code>\n"
+            f"Размер: {format_size(entry.size)}\nИзменён: {modified}"
+        )
+        rows = [
+            [self._button("⬇️ Скачать", f"d:{index}"), self._button("🗑 Удалить", f"rm:{index}")],
+            [self._button("◀️ Назад", "b")],
+        ]
+        return text, InlineKeyboardMarkup(inline_keyboard=rows)
+
+    def render_delete(self, index: int) -> tuple[str, InlineKeyboardMarkup]:
+        entry = self.entries[index]
+        text = f"🗑 Удалить <code>{html.escape(self.child(entry))}</code>?"
+        rows = [[self._button("✅ Удалить", f"rmok:{index}"), self._button("❌ Отмена", "b")]]
+        return text, InlineKeyboardMarkup(inline_keyboard=rows)
+
+    async def delete(self, entry: Entry):
+        async with self.session.sftp_client() as sftp:
+            await sftp.remove(self.child(entry))
+        await self.reload()
+
+    async def show(self, text: str, markup: InlineKeyboardMarkup):
+        try:
+            await self.message.edit_text(text, parse_mode="HTML", reply_markup=markup)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+
+    def close(self):
+        self.cache.close()
@@ -0,0 +1,164 @@
+import asyncio
+import html
+import time
+import zlib
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import BufferedInputFile, Message
+
+TELEGRAM_TEXT_LIMIT = 4096
+# запас под <pre></pre> и строку статуса под выводом
+PAGE_LIMIT = TELEGRAM_TEXT_LIMIT - 256
+# Telegram ограничивает частоту правок примерно одним сообщением в секунду на чат
+EDIT_INTERVAL = 1.5
+# после этого объёма вывод перестаёт дублироваться в чат и отправляется сжатым файлом
+DOCUMENT_THRESHOLD = 64 * 1024
+
+
+def escaped_len(text: str) -> int:
+    return len(text) + 4 * text.count("&") + 3 * (text.count("<") + text.count(">"))
+
+
+def split_page(text: str, limit: int = PAGE_LIMIT) -> tuple[str, str]:
+    # режем так, чтобы после html.escape страница влезла в лимит, по возможности по строке
+    if escaped_len(text) <= limit:
+        return text, ""
+    cut = limit
+    while escaped_len(text[:cut]) > limit:
+        cut -= escaped_len(text[:cut]) - limit
+    newline = text.rfind("\n", 0, cut)
+    if newline > cut // 2:
+        cut = newline + 1
+    return text[:cut], text[cut:]
+
+
+# Потоковый вывод команды в Telegram: одно «живое» сообщение правится по мере поступления
+# данных не чаще EDIT_INTERVAL, при переполнении начинается новое сообщение, а большой
+# вывод сжимается в gzip на лету и уходит документом.
+class OutputStreamer:
+    def __init__(
+        self,
+        message: Message,
+        filename: str = "output.txt",
+        edit_interval: float = EDIT_INTERVAL,
+        document_threshold: int = DOCUMENT_THRESHOLD,
+        reply_markup=None,
+    ):
+        self.message = message
+        # клавиатура «живого» сообщения (например, прерывание), снимается в finish()
+        self.reply_markup = reply_markup
+        self.filename = filename
+        self.edit_interval = edit_interval
+        self.document_threshold = document_threshold
+        self.total = 0
+        self._page = ""          # текст текущего «живого» сообщения
+        self._live: Message | None = None
+        self._shown = ""         # что сейчас реально отображается в живом сообщении
+        self._shown_markup = None
+        self._last_edit = 0.0
+        self._flush_task: asyncio.Task | None = None
+        self._waiting = False
+        self._pending = False    # вывод пришёл, пока правка уже отправлялась
+        self._history: list[str] = []  # весь вывод до порога — чтобы файл был полным
+        self._lock = asyncio.Lock()
+        self._gzip = None
+        self._gzip_parts: list[bytes] = []
+
+    async def feed(self, text: str):
+        if not text:
+            return
+        self.total += len(text)
+        if self._gzip is None and self.total > self.document_threshold:
+            self._gzip = zlib.compressobj(wbits=31)  # 31 — формат gzip
+            self._gzip_parts.append(self._gzip.compress("".join(self._history).encode()))
+            self._history, self._page = [], ""
+        if self._gzip is not None:
+            self._gzip_parts.append(self._gzip.compress(text.encode()))
+        else:
+            self._history.append(text)
+            self._page += text
+        self._schedule()
+
+    def _schedule(self):
+        if self._flush_task and not self._flush_task.done():
+            if not self._waiting:
+                # правка уже идёт и этот вывод может не захватить — после неё нужна ещё одна
+                self._pending = True
+            return
+        delay = self._last_edit + self.edit_interval - time.monotonic()
+        self._flush_task = asyncio.create_task(self._delayed_flush(max(delay, 0)))
+
+    async def _delayed_flush(self, delay: float):
+        while True:
+            self._waiting = True
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._waiting = False
+            self._pending = False
+            await self._flush()
+            if not self._pending:
+                return
+            delay = max(self._last_edit + self.edit_interval - time.monotonic(), 0)
+
+    def _render(self, page: str, note: str = "") -> str:
+        body = f"<pre>{html.escape(page, quote=False)}</pre>" if page.strip() else ""
+        return f"{body}\n{note}".strip()
+
+    async def _show(self, text: str, reply_markup=None):
+        if not text or (text, reply_markup) == (self._shown, self._shown_markup):
+            return
+        while True:
+            try:
+                if self._live is None:
+                    self._live = await self.message.answer(text, parse_mode="HTML", reply_markup=reply_markup)
+                else:
+                    await self._live.edit_text(text, parse_mode="HTML", reply_markup=reply_markup)
+                break
+            except TelegramRetryAfter as e:
+                # сервер сам сказал, сколько ждать — заодно снижаем частоту правок
+                self.edit_interval = max(self.edit_interval, float(e.retry_after))
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    raise
+                break
+        self._shown, self._shown_markup = text, reply_markup
+        self._last_edit = time.monotonic()
+
+    async def _flush(self, note: str = ""):
+        async with self._lock:
+            if self._gzip is not None:
+                size_kb = self.total / 1024
+                return await self._show(
+                    f"📦 Вывод большой ({size_kb:.0f} КБ), будет отправлен файлом…", self.reply_markup
+                )
+            page, rest = split_page(self._page)
+            while rest:
+                # страница заполнена: дописываем её и начинаем следующее сообщение
+                await self._show(self._render(page))
+                self._live, self._shown = None, ""
+                page, rest = split_page(rest)
+            self._page = page
+            await self._show(self._render(page, note), self.reply_markup)
+
+    async def finish(self, note: str = "", empty_text: str = "📥 Команда выполнена. Вывода нет.", reply_markup=None):
+        if self._flush_task and not self._flush_task.done():
+            # ожидающую правку отменяем, а уже идущую дожидаемся — без повтора, его сделает finish
+            if self._waiting:
+                self._flush_task.cancel()
+            else:
+                self._pending = False
+                await self._flush_task
+        self.reply_markup = reply_markup
+        if self._gzip is not None:
+            self._gzip_parts.append(self._gzip.flush())
+            data = b"".join(self._gzip_parts)
+            self._gzip, self._gzip_parts = None, []
+            await self._show(f"📦 Вывод: {self.total / 1024:.0f} КБ, отправлен файлом.\n{note}".strip(), reply_markup)
+            return await self.message.answer_document(
+                BufferedInputFile(data, filename=f"{self.filename}.gz")
+            )
+        if not any(text.strip() for text in self._history):
+            return await self.message.answer(note or empty_text, reply_markup=reply_markup)
+        await self._flush(note)
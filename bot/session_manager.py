@@ -0,0 +1,138 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+import metrics
+from shell_session import ShellSession
+
+SESSION_IDLE_TIMEOUT = 30 * 60  # секунд без команд, после которых сессия закрывается
+MAX_SESSIONS = 200              # всего открытых сессий на бота
+SWEEP_INTERVAL = 60
+
+sessions_evicted = metrics.counter(
+    "rcmu_bot_sessions_evicted_total", "Sessions closed by idle timeout, limits or lost connection", ("reason",))
+
+# SSH-keepalive: мёртвое соединение обнаруживается за interval * count_max секунд
+CONNECT_OPTIONS = {
+    "keepalive_interval": 30,
+    "keepalive_count_max": 3,
+}
+
+
+# Реестр активных SSH-сессий с ограниченным временем жизни.
+#
+# У пользователя не больше одной сессии: новая заменяет прежнюю. При превышении общего
+# лимита закрываются самые давно не использованные (LRU по last_used), простаивающие
+# дольше SESSION_IDLE_TIMEOUT закрываются фоновой задачей, а закрывшийся PTY-канал
+# (обрыв связи, exit в shell) сразу убирает сессию из реестра.
+# Доступ как у словаря: uid in, [uid], get(uid).
+class SessionManager:
+    def __init__(
+        self,
+        on_evict: Callable[[int, str], Awaitable[None]] | None = None,
+        idle_timeout: float = SESSION_IDLE_TIMEOUT,
+        max_sessions: int = MAX_SESSIONS,
+    ):
+        self.on_evict = on_evict
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions: dict[int, ShellSession] = {}
+        self._watchers: dict[int, asyncio.Task] = {}
+        self._sweeper: asyncio.Task | None = None
+        self.evicted = 0
+
+    # --- доступ как к словарю uid -> сессия ---
+    def __contains__(self, uid: int) -> bool:
+        return uid in self._sessions
+
+    def __getitem__(self, uid: int) -> ShellSession:
+        return self._sessions[uid]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, uid: int) -> ShellSession | None:
+        return self._sessions.get(uid)
+
+    # --- жизненный цикл ---
+    async def add(self, uid: int, session: ShellSession):
+        await self.close(uid)
+        while len(self._sessions) >= self.max_sessions:
+            await self._evict(min(self._sessions, key=self._last_used), "общий лимит сессий")
+        session.last_used = time.monotonic()
+        self._sessions[uid] = session
+        self._watchers[uid] = asyncio.create_task(self._watch(uid, session))
+
+    def _last_used(self, uid: int) -> float:
+        return self._sessions[uid].last_used
+
+    async def close(self, uid: int) -> bool:
+        session = self._remove(uid)
+        if session is None:
+            return False
+        await session.close()
+        return True
+
+    def _remove(self, uid: int) -> ShellSession | None:
+        session = self._sessions.pop(uid, None)
+        watcher = self._watchers.pop(uid, None)
+        if watcher and watcher is not asyncio.current_task():
+            watcher.cancel()
+        return session
+
+    async def _evict(self, uid: int, reason: str):
+        session = self._remove(uid)
+        if session is None:
+            return
+        self.evicted += 1
+        sessions_evicted.inc(reason=reason)
+        await session.close()
+        if self.on_evict:
+            try:
+                await self.on_evict(uid, reason)
+            except Exception:
+                pass
+
+    async def _watch(self, uid: int, session: ShellSession):
+        # PTY-канал закрылся сам (обрыв, keepalive не ответил, exit) — сессия мертва
+        try:
+            await session.process.wait_closed()
+        except Exception:
+            pass
+        if self._sessions.get(uid) is session:
+            await self._evict(uid, "соединение потеряно")
+
+    async def sweep(self):
+        now = time.monotonic()
+        for uid, session in list(self._sessions.items()):
+            if session.busy:
+                continue
+            if now - session.last_used > self.idle_timeout:
+                await self._evict(uid, "простой")
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            await self.sweep()
+
+    def start(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def close_all(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+        sessions = [self._remove(uid) for uid in list(self._sessions)]
+        await asyncio.gather(*(s.close() for s in sessions if s), return_exceptions=True)
+
+    # --- метрики ---
+    def stats(self) -> dict:
+        # снимок списка: stats() вызывается и из потока экспортёра метрик
+        sessions = list(self._sessions.values())
+        now = time.monotonic()
+        return {
+            "open_sessions": len(sessions),
+            "memory_bytes": sum(s.memory_footprint() for s in sessions),
+            "oldest_idle_seconds": max((now - s.last_used for s in sessions), default=0),
+            "evicted_total": self.evicted,
+        }
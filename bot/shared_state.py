@@ -0,0 +1,129 @@
+import json
+import os
+import time
+from collections import OrderedDict
+
+# redis нужен только для нескольких процессов бота (webhook.py с воркерами)
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+PENDING_TTL = 10 * 60  # сколько живёт неподтверждённое действие (опасная команда, замена файла)
+REDIS_URL = os.environ.get("RCMU_REDIS_URL")
+REDIS_PREFIX = "rcmu:"
+
+
+# Мелкое состояние «ждём подтверждения от пользователя»: команда из чёрного списка,
+# загрузка поверх существующего файла, скачивание директории. Живое SSH-состояние
+# остаётся в процессе, а это лежит в хранилище с TTL, чтобы подтверждение не терялось,
+# если пользователь попал на другой воркер (перезапуск, изменение их числа), и чтобы
+# забытые подтверждения не висели вечно. Значения — всё, что сериализуется в JSON.
+class MemoryStore:
+    def __init__(self):
+        self._items: dict[str, tuple[float | None, str]] = {}
+
+    def _alive(self, key: str) -> str | None:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires, raw = item
+        if expires is not None and expires < time.monotonic():
+            del self._items[key]
+            return None
+        return raw
+
+    async def get(self, key: str):
+        raw = self._alive(key)
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key: str, value, ttl: float | None = PENDING_TTL):
+        expires = time.monotonic() + ttl if ttl else None
+        self._items[key] = (expires, json.dumps(value))
+        if len(self._items) % 256 == 0:
+            for stale in [k for k, (e, _) in self._items.items() if e is not None and e < time.monotonic()]:
+                del self._items[stale]
+
+    async def pop(self, key: str):
+        raw = self._alive(key)
+        self._items.pop(key, None)
+        return None if raw is None else json.loads(raw)
+
+    async def close(self):
+        pass
+
+
+class RedisStore:
+    def __init__(self, url: str, prefix: str = REDIS_PREFIX):
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    async def get(self, key: str):
+        raw = await self._redis.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key: str, value, ttl: float | None = PENDING_TTL):
+        await self._redis.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    async def pop(self, key: str):
+        # GETDEL: подтверждение срабатывает ровно один раз, даже при двойном нажатии
+        raw = await self._redis.getdel(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+# Кэш в памяти процесса для того, что не обязано переживать смену воркера (хэши файлов,
+# file_id отправленного, смещения докачки): не больше max_items записей, давно не
+# использованные вытесняются, а с ttl записи ещё и устаревают.
+class LRUCache:
+    def __init__(self, max_items: int, ttl: float | None = None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items: OrderedDict = OrderedDict()  # key: (expires, value)
+
+    def get(self, key, default=None):
+        item = self._items.get(key)
+        if item is None:
+            return default
+        if item[0] is not None and item[0] < time.monotonic():
+            del self._items[key]
+            return default
+        self._items.move_to_end(key)
+        return item[1]
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __setitem__(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self._items[key] = (expires, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        value = self.get(key, _MISSING)
+        self._items.pop(key, None)
+        return default if value is _MISSING else value
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+_MISSING = object()
+
+
+def make_store(url: str | None = REDIS_URL):
+    if not url:
+        return MemoryStore()
+    if redis is None:
+        raise RuntimeError("RCMU_REDIS_URL задан, но пакет redis не установлен: pip install redis")
+    return RedisStore(url)
@@ -0,0 +1,314 @@
+import asyncio
+import contextlib
+import re
+import secrets
+import sys
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+from urllib.parse import unquote
+
+import asyncssh
+
+import metrics
+
+COMMAND_TIMEOUT = 30.0  # секунд по умолчанию на одну команду
+READ_CHUNK = 65536
+SFTP_HEALTH_INTERVAL = 30.0  # как часто проверять живость кэшированного SFTP-клиента
+SFTP_HEALTH_TIMEOUT = 5.0
+# ошибки, после которых SFTP-канал считается сломанным и пересоздаётся
+SFTP_BROKEN = (asyncssh.SFTPConnectionLost, asyncssh.ChannelOpenError, asyncssh.DisconnectError, ConnectionError)
+
+# OSC 7 — стандартный способ сообщить терминалу текущую директорию: ESC ] 7 ; file://host/path ST
+_CWD_RE = re.compile(r"\x1b\]7;file://[^/\x07\x1b]*(/[^\x07\x1b]*)(?:\x07|\x1b\\)")
+_CWD_CARRY = 4096  # хвост прошлого куска, в котором могла начаться OSC 7
+# Хук приглашения: после каждой команды shell сам сообщает cwd, так что cd, pushd, cd -
+# и source отслеживаются без отдельного pwd. bash — через PROMPT_COMMAND, zsh — через precmd.
+PROMPT_HOOK = (
+    "__rcmu_cwd() { printf '\\033]7;file://%s%s\\033\\\\' \"${HOSTNAME:-$HOST}\" \"$PWD\"; }; "
+    "PROMPT_COMMAND=__rcmu_cwd; "
+    "[ -n \"$ZSH_VERSION\" ] && eval 'precmd_functions+=(__rcmu_cwd)'"
+)
+
+
+@dataclass
+class CommandResult:
+    output: str
+    exit_status: int | None = None
+    timed_out: bool = False
+    # хвост вывода предыдущей команды, которая не уложилась в таймаут
+    late_output: str = ""
+
+
+# Интерактивный shell (PTY) с детерминированным определением конца команды:
+# после каждой команды в shell отправляется printf с уникальным маркером и кодом выхода,
+# вывод читается ровно до этого маркера, без фиксированных пауз.
+#
+# Сессия не владеет SSH-соединением: PTY-канал держит аренду (lease) у мультиплексора,
+# а SFTP и exec-каналы берут свои аренды через open_channel, так что они могут оказаться
+# на том же соединении или, под нагрузкой, на соседнем.
+class ShellSession:
+    def __init__(
+        self,
+        lease,
+        process,
+        on_cwd: Callable[[str], None] | None = None,
+        open_channel: Callable[[], Awaitable] | None = None,
+        server: str = "",
+    ):
+        self.lease = lease
+        self.server = server  # ip:port, к которому открыта сессия — ключ кэшей по серверу
+        self.conn = lease.conn
+        self.open_channel = open_channel
+        self.process = process
+        self.cwd: str | None = None
+        self.on_cwd = on_cwd
+        self.hooked = False  # shell сам сообщает cwd (хук приглашения сработал)
+        self._cwd_carry = ""
+        self._token = secrets.token_hex(4)
+        self._seq = 0
+        self._buffer = ""
+        self._pending: list[re.Pattern] = []  # маркеры команд, завершившихся по таймауту
+        self._markers: dict[re.Pattern, str] = {}  # ещё не встреченные маркеры -> строка printf
+        self._resent: set[re.Pattern] = set()      # маркеры, повторно отправленные после Ctrl-C
+        self._stray: list[re.Pattern] = []         # их возможные дубли, которые надо вырезать
+        self._lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self._sftp: asyncssh.SFTPClient | None = None
+        self._sftp_lease = None
+        self._sftp_checked = 0.0
+        self._sftp_lock = asyncio.Lock()
+
+    async def start(self, timeout: float = COMMAND_TIMEOUT):
+        # Отключаем эхо и приглашение: в выводе остаётся только то, что печатает команда.
+        # Приветствие сервера (motd) и прочий шум до первого маркера отбрасываются.
+        await self.run("stty -echo; PS1=''; PS2=''", timeout=timeout)
+        await self.run(PROMPT_HOOK, timeout=timeout)
+        # хук срабатывает на приглашении сразу после установки; если OSC 7 не пришла —
+        # shell не bash/zsh (sh, dash, ash), и cwd придётся спрашивать через pwd
+        self.hooked = self.cwd is not None
+        await self.refresh_cwd(timeout)
+
+    async def refresh_cwd(self, timeout: float = COMMAND_TIMEOUT) -> str | None:
+        # без хука cwd не отслеживается сам: перед действием с текущей директорией спрашиваем pwd
+        if not self.hooked:
+            output = (await self.run("pwd", timeout=timeout)).output
+            for line in reversed(output.splitlines()):
+                if line.strip().startswith("/"):
+                    self._set_cwd(line.strip())
+                    break
+        return self.cwd
+
+    def _new_marker(self):
+        self._seq += 1
+        tag = f"{self._token}_{self._seq}"
+        # в эхе строки стоит %s, а не цифры, так что регулярка совпадает только с выводом printf
+        line = f"printf '\\n__RCMU_{tag}_%s__\\n' \"$?\"\n"
+        pattern = re.compile(rf"\r?\n?__RCMU_{tag}_(\d+)__\r?\n")
+        return line, pattern
+
+    async def _read_until(self, pattern: re.Pattern, timeout: float, on_output=None):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            m = pattern.search(self._buffer)
+            if m:
+                output = self._buffer[:m.start()]
+                self._buffer = self._buffer[m.end():]
+                self._settle(pattern)
+                if on_output and output:
+                    await on_output(output)
+                    output = ""
+                return output, int(m.group(1))
+            if on_output:
+                # при потоковой передаче буфер не копится: всё, кроме возможного начала маркера, уходит сразу
+                partial = self._take_partial()
+                if partial:
+                    await on_output(partial)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            chunk = await asyncio.wait_for(self.process.stdout.read(READ_CHUNK), remaining)
+            if not chunk:
+                raise ConnectionError("SSH-сессия закрыта")
+            metrics.transfer_bytes.inc(len(chunk), op="pty_output")
+            self._track_cwd(chunk)
+            self._buffer += chunk
+            for stray in list(self._stray):
+                self._buffer, found = stray.subn("", self._buffer, count=1)
+                if found:
+                    self._stray.remove(stray)
+
+    def _settle(self, pattern: re.Pattern):
+        self._markers.pop(pattern, None)
+        if pattern in self._resent:
+            # оригинальный маркер мог пережить Ctrl-C и прийти вторым — его вырежем, когда появится
+            self._resent.discard(pattern)
+            self._stray = (self._stray + [pattern])[-8:]
+
+    def _track_cwd(self, chunk: str):
+        data = self._cwd_carry + chunk
+        self._cwd_carry = data[-_CWD_CARRY:]
+        if "\x1b]7;" not in data:
+            return
+        last = None
+        for last in _CWD_RE.finditer(data):
+            pass
+        if last:
+            self._set_cwd(unquote(last.group(1)))
+
+    def _set_cwd(self, cwd: str):
+        if cwd != self.cwd:
+            self.cwd = cwd
+            if self.on_cwd:
+                self.on_cwd(cwd)
+
+    def _take_partial(self):
+        # отдаём накопленный вывод, но придерживаем хвост, который может оказаться началом маркера
+        tail_start = self._buffer.rfind("\n") + 1
+        tail = self._buffer[tail_start:]
+        if tail and len(tail) < 64 and "__RCMU_".startswith(tail[:7]):
+            output, self._buffer = self._buffer[:tail_start], tail
+        else:
+            output, self._buffer = self._buffer, ""
+        return output
+
+    def _split_late(self, output: str):
+        # всё до маркера ранее «зависшей» команды относится к ней, а не к текущей
+        late = ""
+        for pattern in list(self._pending):
+            m = pattern.search(output)
+            if m:
+                late += output[:m.start()]
+                output = output[m.end():]
+                self._pending.remove(pattern)
+                self._settle(pattern)
+        return late, output
+
+    async def run(
+        self,
+        command: str,
+        timeout: float = COMMAND_TIMEOUT,
+        on_output: Callable[[str], Awaitable[None]] | None = None,
+    ) -> CommandResult:
+        # Если передан on_output, вывод отдаётся в него по мере поступления, а в результате
+        # остаётся только то, что не было передано. Пока не дочитан хвост «зависшей» команды,
+        # поток не включается, чтобы не перемешать вывод двух команд.
+        async with self._lock:
+            self.last_used = time.monotonic()
+            marker_line, pattern = self._new_marker()
+            stream = on_output if not self._pending else None
+            self._markers[pattern] = marker_line
+            self.process.stdin.write(f"{command}\n{marker_line}")
+            started = time.perf_counter()
+            try:
+                output, status = await self._read_until(pattern, timeout, stream)
+            except asyncio.TimeoutError:
+                metrics.errors.inc(op="pty_command", error="timeout")
+                output = self._take_partial()
+                if stream and output:
+                    await stream(output)
+                    output = ""
+                self._pending.append(pattern)
+                late, output = self._split_late(output)
+                return CommandResult(output, None, True, late)
+            metrics.ssh_command_seconds.observe(time.perf_counter() - started, frontend="bot", mode="pty")
+            late, output = self._split_late(output)
+            return CommandResult(output, status, False, late)
+
+    def interrupt(self) -> bool:
+        # Ctrl-C для текущей или зависшей по таймауту команды. Терминал при этом сбрасывает
+        # непрочитанный shell ввод вместе с нашими маркерами, поэтому они отправляются заново,
+        # и ожидание в run() завершается сразу, а не по таймауту. Возвращает False, если
+        # прерывать было нечего.
+        if not self._markers:
+            return False
+        self._resent.update(self._markers)
+        self.process.stdin.write("\x03" + "".join(self._markers.values()))
+        return True
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def memory_footprint(self) -> int:
+        # приблизительно: свои буферы вывода и ещё не прочитанное из PTY-канала
+        # (приёмные буферы процесса и канала asyncssh — внутренние, поэтому через getattr)
+        size = sys.getsizeof(self._buffer) + sys.getsizeof(self._cwd_carry)
+        for chunks in getattr(self.process, "_recv_buf", {}).values():
+            size += sum(len(chunk) for chunk in chunks)
+        channel = getattr(self.process, "channel", None)
+        size += sum(len(data) for data, _ in getattr(channel, "_recv_buf", ()))
+        return size
+
+    async def _drop_sftp(self, sftp: asyncssh.SFTPClient | None = None):
+        if self._sftp is None or (sftp is not None and sftp is not self._sftp):
+            return
+        sftp, self._sftp = self._sftp, None
+        lease, self._sftp_lease = self._sftp_lease, None
+        try:
+            sftp.exit()
+            await asyncio.wait_for(sftp.wait_closed(), SFTP_HEALTH_TIMEOUT)
+        except Exception:
+            pass
+        finally:
+            if lease is not None:
+                lease.release()
+
+    @contextlib.asynccontextmanager
+    async def channel(self):
+        # соединение для ещё одного канала (SFTP, exec); аренда возвращается при выходе
+        if self.open_channel is None:
+            yield self.conn
+            return
+        lease = await self.open_channel()
+        try:
+            yield lease.conn
+        finally:
+            lease.release()
+
+    async def get_sftp(self) -> asyncssh.SFTPClient:
+        # Один SFTP-клиент на сессию, создаётся при первом обращении. Если им давно
+        # не пользовались, перед выдачей проверяем его дешёвым stat.
+        async with self._sftp_lock:
+            loop = asyncio.get_running_loop()
+            if self._sftp is not None and loop.time() - self._sftp_checked > SFTP_HEALTH_INTERVAL:
+                try:
+                    await asyncio.wait_for(self._sftp.stat("."), SFTP_HEALTH_TIMEOUT)
+                except Exception:
+                    await self._drop_sftp()
+            if self._sftp is None:
+                lease = await self.open_channel() if self.open_channel else None
+                try:
+                    conn = lease.conn if lease else self.conn
+                    self._sftp = await conn.start_sftp_client()
+                except BaseException:
+                    if lease:
+                        lease.release()
+                    raise
+                self._sftp_lease = lease
+            self._sftp_checked = loop.time()
+            return self._sftp
+
+    @contextlib.asynccontextmanager
+    async def sftp_client(self):
+        # как conn.start_sftp_client(), но без повторного согласования подсистемы на каждую операцию
+        sftp = await self.get_sftp()
+        self.last_used = time.monotonic()
+        try:
+            yield sftp
+        except SFTP_BROKEN:
+            await self._drop_sftp(sftp)
+            raise
+        else:
+            self._sftp_checked = asyncio.get_running_loop().time()
+
+    async def close(self):
+        await self._drop_sftp()
+        try:
+            self.process.stdin.write("exit\n")
+            await asyncio.wait_for(self.process.wait_closed(), 5)
+        except Exception:
+            self.process.close()
+        # соединение закроет мультиплексор, когда на нём не останется каналов
+        self.lease.release()
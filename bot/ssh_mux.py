@@ -0,0 +1,154 @@
+import asyncio
+import contextlib
+import hashlib
+import time
+
+import asyncssh
+
+import metrics
+
+MAX_CHANNELS_PER_CONNECTION = 8  # у OpenSSH по умолчанию MaxSessions 10 — оставляем запас
+MAX_CONNECTIONS_PER_KEY = 4      # больше соединений к одной учётке открываем только под нагрузкой
+IDLE_LINGER = 60.0               # сколько держать соединение без каналов на случай повторного использования
+CONNECT_TIMEOUT = 15.0
+
+
+def credential_key(host: str, port, username: str, password: str) -> tuple:
+    # пароль в ключе только в виде отпечатка
+    fingerprint = hashlib.sha256(password.encode()).hexdigest()[:16]
+    return host, int(port), username, fingerprint
+
+
+class _MuxConnection:
+    def __init__(self, conn: asyncssh.SSHClientConnection):
+        self.conn = conn
+        self.channels = 0
+        self.closed = False
+        self.idle_since = time.monotonic()
+
+
+# Аренда одного канала (PTY, exec или SFTP) на общем соединении; release() идемпотентен
+class ChannelLease:
+    def __init__(self, mux: "ConnectionMux", key: tuple, entry: _MuxConnection):
+        self._mux = mux
+        self._key = key
+        self._entry = entry
+        self.conn = entry.conn
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._mux._release(self._key, self._entry)
+
+
+# Мультиплексор SSH-соединений в духе ControlMaster: пользователи и каналы с одинаковыми
+# (host, port, user, отпечаток пароля) работают поверх одного аутентифицированного соединения.
+# Каналы считаются по ссылкам; новое соединение к той же учётке открывается, только когда на
+# всех существующих занято MAX_CHANNELS_PER_CONNECTION каналов. Соединение без каналов живёт
+# ещё IDLE_LINGER секунд. Ключ хоста запоминается при первом подключении (TOFU) и дальше
+# проверяется по кэшу без повторного согласования.
+class ConnectionMux:
+    def __init__(
+        self,
+        connect_options: dict | None = None,
+        max_channels: int = MAX_CHANNELS_PER_CONNECTION,
+        max_connections: int = MAX_CONNECTIONS_PER_KEY,
+        linger: float = IDLE_LINGER,
+    ):
+        self.connect_options = connect_options or {}
+        self.max_channels = max_channels
+        self.max_connections = max_connections
+        self.linger = linger
+        self.host_keys: dict[tuple[str, int], asyncssh.SSHKey] = {}
+        self._pools: dict[tuple, list[_MuxConnection]] = {}
+        self._locks: dict[tuple, asyncio.Lock] = {}
+        self.handshakes = 0
+
+    async def _connect(self, host: str, port: int, username: str, password: str) -> _MuxConnection:
+        options = dict(self.connect_options)
+        known_key = self.host_keys.get((host, port))
+        if known_key is not None:
+            options["known_hosts"] = ([known_key], [], [])
+            options["server_host_key_algs"] = [known_key.get_algorithm()]
+        else:
+            options["known_hosts"] = None
+        with metrics.track(metrics.ssh_connect_seconds, "ssh_connect", frontend="bot"):
+            conn = await asyncio.wait_for(
+                asyncssh.connect(host, port=port, username=username, password=password, **options),
+                CONNECT_TIMEOUT,
+            )
+        self.handshakes += 1
+        if known_key is None:
+            server_key = conn.get_server_host_key()
+            if server_key is not None:
+                self.host_keys[(host, port)] = server_key
+        entry = _MuxConnection(conn)
+        asyncio.create_task(self._watch(entry))
+        return entry
+
+    async def _watch(self, entry: _MuxConnection):
+        try:
+            await entry.conn.wait_closed()
+        finally:
+            entry.closed = True
+
+    async def acquire(self, host: str, port, username: str, password: str) -> ChannelLease:
+        key = credential_key(host, port, username, password)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            pool = [e for e in self._pools.get(key, []) if not e.closed]
+            self._pools[key] = pool
+            free = [e for e in pool if e.channels < self.max_channels]
+            if free:
+                entry = min(free, key=lambda e: e.channels)
+            elif len(pool) < self.max_connections:
+                entry = await self._connect(host, int(port), username, password)
+                pool.append(entry)
+            else:
+                # все соединения заняты — перегружаем наименее загруженное, сервер сам скажет, если это слишком
+                entry = min(pool, key=lambda e: e.channels)
+            entry.channels += 1
+        return ChannelLease(self, key, entry)
+
+    @contextlib.asynccontextmanager
+    async def channel(self, host: str, port, username: str, password: str):
+        lease = await self.acquire(host, port, username, password)
+        try:
+            yield lease.conn
+        finally:
+            lease.release()
+
+    def _release(self, key: tuple, entry: _MuxConnection):
+        entry.channels -= 1
+        if entry.channels <= 0:
+            entry.channels = 0
+            entry.idle_since = time.monotonic()
+            asyncio.get_running_loop().call_later(self.linger, self._close_if_idle, key, entry)
+
+    def _close_if_idle(self, key: tuple, entry: _MuxConnection):
+        if entry.channels or entry.closed or time.monotonic() - entry.idle_since < self.linger:
+            return
+        pool = self._pools.get(key, [])
+        if entry in pool:
+            pool.remove(entry)
+        if not pool:
+            self._pools.pop(key, None)
+        entry.conn.close()
+
+    async def close_all(self):
+        entries = [e for pool in self._pools.values() for e in pool]
+        self._pools.clear()
+        for entry in entries:
+            entry.conn.close()
+        await asyncio.gather(*(e.conn.wait_closed() for e in entries), return_exceptions=True)
+
+    def stats(self) -> dict:
+        # снимки списков: stats() вызывается и из потока экспортёра метрик
+        entries = [e for pool in list(self._pools.values()) for e in list(pool) if not e.closed]
+        return {
+            "connections": len(entries),
+            "channels": sum(e.channels for e in entries),
+            "handshakes_total": self.handshakes,
+            "cached_host_keys": len(self.host_keys),
+        }
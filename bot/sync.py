@@ -0,0 +1,116 @@
+import hashlib
+import shlex
+from typing import AsyncIterator, Awaitable
+
+HASH_BATCH = 64         # файлов на один запуск sha256sum
+PART_SUFFIX = ".part"   # недокачанная загрузка лежит рядом с целевым файлом под этим именем
+
+
+# ======== Хэши на стороне сервера (exec, без чтения файла через SFTP) ========
+async def remote_sha256(conn, path: str, length: int | None = None) -> str | None:
+    # sha256 всего файла или только первых length байт; None, если файла нет или нет sha256sum
+    quoted = shlex.quote(path)
+    command = f"sha256sum -- {quoted}" if length is None else f"head -c {int(length)} -- {quoted} | sha256sum"
+    result = await conn.run(command, check=False)
+    if result.exit_status or not result.stdout:
+        return None
+    return result.stdout.split()[0]
+
+
+async def remote_sha256_many(conn, base: str, paths: list[str]) -> dict[str, str]:
+    hashes: dict[str, str] = {}
+    for i in range(0, len(paths), HASH_BATCH):
+        batch = paths[i:i + HASH_BATCH]
+        command = f"cd {shlex.quote(base)} && sha256sum -- " + " ".join(shlex.quote(p) for p in batch)
+        result = await conn.run(command, check=False)
+        for line in (result.stdout or "").splitlines():
+            digest, _, name = line.partition("  ")
+            # имена с \\ и переводами строк sha256sum экранирует — такие просто не попадут в кэш
+            if name and not digest.startswith("\\"):
+                hashes[name] = digest
+    return hashes
+
+
+async def list_remote_tree(conn, path: str) -> dict[str, tuple[int, float]]:
+    # все обычные файлы под path одним find: относительный путь -> (размер, mtime)
+    command = f"cd {shlex.quote(path)} && find . -type f -printf '%P\\0%s\\0%T@\\0'"
+    result = await conn.run(command, check=False)
+    if result.exit_status:
+        raise OSError((result.stderr or "").strip() or f"find: код выхода {result.exit_status}")
+    fields = (result.stdout or "").split("\0")
+    tree = {}
+    for i in range(0, len(fields) - 2, 3):
+        tree[fields[i]] = (int(fields[i + 1]), float(fields[i + 2]))
+    return tree
+
+
+async def changed_files(conn, path: str, previous: dict) -> tuple[list[str], dict, list[str]]:
+    # Сравнение с манифестом прошлой синхронизации: {путь: [размер, mtime, sha256]}.
+    # Размер и mtime совпали — файл не трогаем; размер тот же, а mtime новый — решает хэш
+    # (touch, пересборка с тем же результатом). Возвращает (изменённые, новый манифест, удалённые).
+    current = await list_remote_tree(conn, path)
+    changed, manifest, to_hash = [], {}, []
+    for name, (size, mtime) in current.items():
+        old = previous.get(name)
+        if old and old[0] == size and old[1] == mtime:
+            manifest[name] = list(old)
+        else:
+            to_hash.append(name)
+    hashes = await remote_sha256_many(conn, path, to_hash)
+    for name in to_hash:
+        size, mtime = current[name]
+        old = previous.get(name)
+        digest = hashes.get(name)
+        manifest[name] = [size, mtime, digest]
+        if not (old and digest and old[0] == size and old[2] == digest):
+            changed.append(name)
+    removed = sorted(set(previous) - set(current))
+    return sorted(changed), manifest, removed
+
+
+# ======== Потоки с хэшированием и докачкой ========
+async def hashing(source: AsyncIterator[bytes], hasher) -> AsyncIterator[bytes]:
+    async for chunk in source:
+        hasher.update(chunk)
+        yield chunk
+
+
+async def sha256_of(source: AsyncIterator[bytes]) -> str:
+    hasher = hashlib.sha256()
+    async for chunk in source:
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+async def skip_verified(
+    source: AsyncIterator[bytes],
+    length: int,
+    remote_hash: Awaitable[str | None],
+    hasher=None,
+) -> AsyncIterator[bytes] | None:
+    # Докачка: первые length байт источника уже лежат на сервере. Они вычитываются и
+    # хэшируются, и если хэш совпал с remote_hash — возвращается поток оставшихся байт,
+    # иначе None (начало файла на сервере не то, качать надо с нуля).
+    # hasher, если передан, — хэш всего файла: в него попадает только пропущенное начало.
+    hasher = hasher or hashlib.sha256()
+    stream = source.__aiter__()
+    consumed = 0
+    leftover = b""
+    async for chunk in stream:
+        need = length - consumed
+        hasher.update(chunk[:need])
+        consumed += min(len(chunk), need)
+        if consumed >= length:
+            leftover = chunk[need:]
+            break
+    if consumed < length or hasher.copy().hexdigest() != await remote_hash:
+        await stream.aclose()
+        return None
+
+    async def rest():
+        if leftover:
+            yield leftover
+        async for chunk in stream:
+            yield chunk
+
+    return rest()
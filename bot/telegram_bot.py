@@ -1,27 +1,106 @@
 import asyncio
 import asyncssh
-import re
+import contextlib
+import hashlib
+import html
+import os
+import posixpath
+import shlex
+import sys
 from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import (
     Message, ReplyKeyboardMarkup, KeyboardButton,
-    InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputFile, FSInputFile
+    InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputFile, BufferedInputFile,
+    InputMediaDocument,
 )
 from aiogram.filters import Command
 from tempfile import NamedTemporaryFile
 
+# metrics.py лежит в корне репозитория и общий с веб-частью
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+import scrollback
 from botToken import TOKEN
+from shell_session import ShellSession, COMMAND_TIMEOUT
+from session_manager import SessionManager, CONNECT_OPTIONS
+from ssh_mux import ConnectionMux
+from command_queue import CommandQueue, QueueFull
+from watch import Watch, WATCH_INTERVAL, WATCH_MAX_INTERVAL
+from file_browser import FileBrowser
+from shared_state import LRUCache, make_store
+from output_streamer import PAGE_LIMIT, OutputStreamer, escaped_len
+from term_sanitizer import TerminalSanitizer, sanitize
+from fanout import fanout, format_summary, host_label, parse_hosts
+from archives import ARCHIVE_CODECS, ARCHIVE_LEVELS, PART_SIZE, ArchiveError, stream_archive
+from sync import PART_SUFFIX, changed_files, hashing, remote_sha256, sha256_of, skip_verified
+from transfers import (
+    BLOCK_SIZE, SFTPInputFile, TransferProgress, stream_to_sftp, telegram_chunks, format_size,
+    expand_remote_patterns, fetch_files, TELEGRAM_DOWNLOAD_LIMIT,
+)
 
 # ======== Инициализация ========
-bot = Bot(token=TOKEN)
+# свой сервер Bot API (telegram-bot-api --local или заглушка в бенчмарках) вместо api.telegram.org
+TELEGRAM_API = os.environ.get("RCMU_TELEGRAM_API")
+bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API)) if TELEGRAM_API else None)
 dp = Dispatcher()
 
+
+async def telegram_request_metrics(make_request, bot, method):
+    # каждый вызов Bot API, включая answer_document с потоком из SFTP внутри
+    with metrics.track(metrics.telegram_request_seconds, "telegram_api", method=type(method).__name__):
+        return await make_request(bot, method)
+
+
+if metrics.ENABLED:
+    bot.session.middleware(telegram_request_metrics)
+
 # ======== Временное хранилище для SSH данных ========
 # ключи: ip, port, username, password, input_mode (bool), editing (bool)
 user_data: dict[int, dict] = {}
-active_sessions = {}  # user_id: SSHClientConnection
-pending_commands: dict[int, str] = {}
-pending_uploads: dict[int, dict] = {}  # uid: {"local_path": str, "remote_path": str, "file_name": str}
+
+
+async def on_session_evicted(uid: int, reason: str):
+    # менеджер сам закрыл сессию (простой, лимиты, обрыв) — синхронизируем кнопку и сообщаем
+    if uid in user_data:
+        user_data[uid]["input_mode"] = False
+    drop_command_queue(uid)
+    stop_watch(uid)
+    close_browser(uid)
+    await bot.send_message(uid, f"🔌 SSH-сессия закрыта: {reason}.", reply_markup=get_tools_kb(uid))
+
+
+active_sessions = SessionManager(on_evict=on_session_evicted)  # user_id: ShellSession
+# общие SSH-соединения: сессии, SFTP, архивы и fan-out к одному серверу делят одно рукопожатие
+ssh_mux = ConnectionMux(CONNECT_OPTIONS)
+# Ожидающие подтверждения — в общем хранилище (память процесса или redis, см. shared_state.py):
+#   command:<uid>     — команда из чёрного списка, ждущая «Выполнить в любом случае»
+#   upload:<uid>      — {"file_id", "file_unique_id", "file_size", "remote_path", "file_name"}
+#   confirm_dir:<uid> — запрошено скачивание текущей директории
+pending = make_store()
+command_queues: dict[int, CommandQueue] = {}  # uid: очередь команд текущей сессии
+watches: dict[int, Watch] = {}  # uid: активное наблюдение /watch
+browsers: dict[int, FileBrowser] = {}  # uid: проводник с кэшем листингов текущей сессии
+# докачка и пропуск неизменённого
+TRANSFER_CACHE_ITEMS = 10_000
+RESUME_TTL = 24 * 60 * 60  # сколько помнить прерванную передачу
+telegram_hashes = LRUCache(TRANSFER_CACHE_ITEMS)              # file_unique_id: sha256 файла из Telegram
+partial_uploads = LRUCache(TRANSFER_CACHE_ITEMS, RESUME_TTL)  # (file_unique_id, remote_path): подтверждённое смещение .part
+pending_downloads = LRUCache(TRANSFER_CACHE_ITEMS, RESUME_TTL)  # chat_id: прерванная отправка файла частями
+resume_download_kb = InlineKeyboardMarkup(
+    inline_keyboard=[[InlineKeyboardButton(text="▶️ Продолжить", callback_data="resume_download")]]
+)
+sent_files = LRUCache(TRANSFER_CACHE_ITEMS)  # (chat_id, ip:port, remote_path): (size, mtime, [file_id частей])
+SYNC_MAX_MEMBERS = 5000  # больше изменённых файлов — архивируем директорию целиком
+MEDIA_GROUP_SIZE = 10  # документов в одной медиагруппе Telegram
+# больше этого суммарного объёма (или файлов) пакет отправляется одним потоковым архивом
+MEDIA_GROUP_MAX_BYTES = 40 * 1024 * 1024
+MEDIA_GROUP_MAX_FILES = 30
 BLACKLIST = {'nano', 'vim', 'vi', 'top', 'htop', 'less', 'more'}
+# чем заменить интерактивный монитор в режиме /watch
+WATCH_HINTS = {'top': 'top -b -n 1 | head -25', 'htop': 'top -b -n 1 | head -25'}
 
 # ======== Клавиатуры ========
 main_kb = ReplyKeyboardMarkup(
@@ -46,6 +125,54 @@ force_exec_kb = InlineKeyboardMarkup(
     ]
 )
 
+interrupt_kb = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="⛔ Прервать (Ctrl-C)", callback_data="interrupt")]
+    ]
+)
+
+# ======== Буфер прокрутки ========
+# весь вывод команд сессии копится в кольцевом буфере (scrollback.py), по нему можно
+# листать назад или получить его файлом, даже когда сообщения с выводом уже ушли
+SCROLLBACK_PAGE = 3000  # байт буфера на одно нажатие «Показать ещё»
+scrollback_cursor: dict[int, int] = {}  # uid: смещение, раньше которого вывод ещё не показан
+scrollback_row = [
+    InlineKeyboardButton(text="📜 Показать ещё", callback_data="sb_more"),
+    InlineKeyboardButton(text="📄 Весь вывод файлом", callback_data="sb_file"),
+]
+scrollback_kb = InlineKeyboardMarkup(inline_keyboard=[scrollback_row])
+interrupt_scrollback_kb = InlineKeyboardMarkup(inline_keyboard=interrupt_kb.inline_keyboard + [scrollback_row])
+
+
+def scrollback_key(uid: int) -> str:
+    return f"bot:{uid}"
+
+
+def record_output(uid: int, text: str):
+    if text:
+        scrollback.store.write(scrollback_key(uid), text.encode())
+
+
+# ======== Метрики сессий ========
+# считаются при каждом опросе экспортёра (в его потоке), поэтому читают только снимки
+def session_memory() -> dict[tuple, float]:
+    return {
+        ("shell",): active_sessions.stats()["memory_bytes"],
+        ("scrollback",): scrollback.store.stats()["bytes"],
+        ("listings",): sum(b.cache.memory_footprint() for b in list(browsers.values())),
+    }
+
+
+metrics.gauge(
+    "rcmu_bot_sessions", "Open SSH shell sessions of the bot",
+    collect=lambda: {(): active_sessions.stats()["open_sessions"]})
+metrics.gauge(
+    "rcmu_bot_session_memory_bytes", "Approximate memory held for user sessions", ("part",),
+    collect=session_memory)
+metrics.gauge(
+    "rcmu_bot_ssh_connections", "SSH connections and channels held by the connection mux", ("kind",),
+    collect=lambda: {(kind,): value for kind, value in ssh_mux.stats().items() if kind in ("connections", "channels")})
+
 
 def get_tools_kb(user_id: int) -> ReplyKeyboardMarkup:
     data = user_data.get(user_id, {})
@@ -59,11 +186,308 @@ def get_tools_kb(user_id: int) -> ReplyKeyboardMarkup:
                 KeyboardButton(text="Загрузить в текущ. директорию"),
                 KeyboardButton(text="Скачать текущ. директорию"),
             ],
+            [KeyboardButton(text="Обзор файлов")],
             [KeyboardButton(text="Назад")]
         ],
         resize_keyboard=True
     )
 
+def get_timeout(user_id: int) -> float:
+    return user_data.get(user_id, {}).get("command_timeout", COMMAND_TIMEOUT)
+
+
+def path_tracker(user_id: int):
+    # shell сам сообщает cwd после каждой команды — просто запоминаем его
+    def on_cwd(path: str):
+        if user_id in user_data:
+            user_data[user_id]["current_path"] = path
+        # приглашение приходит после каждой команды: cd, rm, mv в этой директории — листинг устарел
+        invalidate_listing(user_id, path)
+    return on_cwd
+
+
+async def current_path(uid: int) -> str:
+    # shell без хука приглашения (sh, dash) cwd сам не сообщает — уточняем через pwd
+    session = active_sessions.get(uid)
+    if session and not session.hooked:
+        try:
+            await session.refresh_cwd(get_timeout(uid))
+        except (asyncio.TimeoutError, ConnectionError):
+            pass  # остаётся последний известный путь
+    return user_data[uid].get("current_path", ".")
+
+
+def invalidate_listing(user_id: int, path: str):
+    browser = browsers.get(user_id)
+    if browser:
+        browser.cache.invalidate(path)
+
+
+def close_browser(uid: int):
+    browser = browsers.pop(uid, None)
+    if browser:
+        browser.close()
+
+
+async def telegram_sha256(upload: dict) -> str:
+    unique_id = upload["file_unique_id"]
+    if unique_id not in telegram_hashes:
+        telegram_hashes[unique_id] = await sha256_of(telegram_chunks(bot, upload["file_id"]))
+    return telegram_hashes[unique_id]
+
+
+async def is_same_file(session: ShellSession, upload: dict, remote_size: int | None) -> bool:
+    # размер совпал — сверяем sha256 файла из Telegram (кэш по file_unique_id) и sha256sum на сервере
+    if remote_size != upload["file_size"]:
+        return False
+    async with session.channel() as conn:
+        local, remote = await asyncio.gather(telegram_sha256(upload), remote_sha256(conn, upload["remote_path"]))
+    return local == remote
+
+
+async def resume_offset(sftp, part_path: str, key: tuple[str, str]) -> int:
+    # С какого места можно продолжить .part: подтверждённое смещение прошлой попытки или,
+    # если бот перезапускался, размер файла, округлённый вниз до блока. Проверяется хэшем.
+    try:
+        size = (await sftp.stat(part_path)).size or 0
+    except asyncssh.SFTPNoSuchFile:
+        partial_uploads.pop(key, None)
+        return 0
+    recorded = partial_uploads.get(key)
+    if recorded is not None:
+        return min(recorded, size)
+    return size // BLOCK_SIZE * BLOCK_SIZE
+
+
+async def upload_from_telegram(message: Message, session: ShellSession, sftp, upload: dict):
+    # Файл идёт из Telegram прямо в SFTP, без /tmp и без чтения целиком в память. Пишется в
+    # .part рядом с целевым файлом и переименовывается в конце, поэтому оборванную загрузку
+    # можно повторить: уже подтверждённое начало .part сверяется по sha256 и не пишется заново.
+    remote_path = upload["remote_path"]
+    part_path = remote_path + PART_SUFFIX
+    key = (upload["file_unique_id"], remote_path)
+    hasher = hashlib.sha256()
+    start = await resume_offset(sftp, part_path, key)
+    source = None
+    if start:
+        async with session.channel() as conn:
+            remote_hash = asyncio.create_task(remote_sha256(conn, part_path, start))
+            source = await skip_verified(telegram_chunks(bot, upload["file_id"]), start, remote_hash, hasher)
+        if source is None:
+            start, hasher = 0, hashlib.sha256()
+    if source is None:
+        source = telegram_chunks(bot, upload["file_id"])
+
+    title = f"⬆️ Загрузка (продолжение с {format_size(start)})" if start else "⬆️ Загрузка"
+    progress = TransferProgress(message, title, upload["file_size"] - start)
+    await stream_to_sftp(
+        sftp, hashing(source, hasher), part_path, progress,
+        start=start, on_commit=lambda offset: partial_uploads.__setitem__(key, offset),
+    )
+    try:
+        await sftp.posix_rename(part_path, remote_path)
+    except (asyncssh.SFTPOpUnsupported, asyncssh.SFTPFailure):
+        # без расширения posix-rename обычный rename не перезаписывает существующий файл
+        with contextlib.suppress(asyncssh.SFTPNoSuchFile):
+            await sftp.remove(remote_path)
+        await sftp.rename(part_path, remote_path)
+    partial_uploads.pop(key, None)
+    telegram_hashes[upload["file_unique_id"]] = hasher.hexdigest()
+    return progress
+
+
+def resume_hint(upload: dict) -> str:
+    offset = partial_uploads.get((upload["file_unique_id"], upload["remote_path"]))
+    if not offset:
+        return ""
+    return f"\nЗагружено {format_size(offset)} — отправьте тот же файл ещё раз, загрузка продолжится."
+
+
+async def send_remote_file(message: Message, sftp, server: str, remote_path: str, filename: str):
+    attrs = await sftp.stat(remote_path)
+    size = attrs.size or 0
+    # тот же файл (сервер, путь, размер и mtime) уже отправлялся в этот чат — пересылаем по file_id
+    cached = sent_files.get((message.chat.id, server, remote_path))
+    if cached and cached[:2] == (size, attrs.mtime):
+        for file_id in cached[2]:
+            await message.answer_document(file_id)
+        return await message.answer(f"♻️ {filename} не изменился с прошлой отправки, передача пропущена.")
+    state = {"server": server, "remote_path": remote_path, "filename": filename, "size": size,
+             "mtime": attrs.mtime, "next_part": 0, "file_ids": []}
+    await send_file_parts(message, sftp, state)
+
+
+async def send_file_parts(message: Message, sftp, state: dict):
+    # Файл больше лимита Bot API уходит частями по PART_SIZE, каждая читается из SFTP по своему
+    # смещению. Часть, которую Telegram принял, считается подтверждённой: после сбоя отправка
+    # продолжается со следующей (кнопка «Продолжить»), а не с начала файла.
+    size, filename = state["size"], state["filename"]
+    parts = max(1, -(-size // PART_SIZE))
+    done = state["next_part"] * PART_SIZE
+    progress = TransferProgress(message, f"⬇️ {filename}", size - done)
+    pending_downloads[message.chat.id] = state
+    for index in range(state["next_part"], parts):
+        name = filename if parts == 1 else f"{filename}.{index + 1:03d}"
+        try:
+            sent = await message.answer_document(SFTPInputFile(
+                sftp, state["remote_path"], name, progress, start=index * PART_SIZE, length=PART_SIZE,
+            ))
+        except Exception as e:
+            await progress.finish(f"⏸ {filename}: отправлено частей {index} из {parts}")
+            return await message.answer(
+                f"❌ Передача {filename} прервана на части {index + 1}: {e}", reply_markup=resume_download_kb,
+            )
+        state["file_ids"].append(sent.document.file_id if sent.document else None)
+        state["next_part"] = index + 1
+    pending_downloads.pop(message.chat.id, None)
+    if all(state["file_ids"]):
+        sent_files[(message.chat.id, state["server"], state["remote_path"])] = (size, state["mtime"], state["file_ids"])
+    note = f", частей: {parts} (склеить: cat {filename}.* > {filename})" if parts > 1 else ""
+    await progress.finish(f"✅ {filename}: {progress.summary()}{note}")
+
+
+async def resume_download(message: Message, session: ShellSession, state: dict):
+    async with session.sftp_client() as sftp:
+        attrs = await sftp.stat(state["remote_path"])
+        if (attrs.size or 0, attrs.mtime) != (state["size"], state["mtime"]):
+            # файл изменился — уже отправленные части не подходят, начинаем заново
+            await message.answer(f"⚠️ {state['filename']} изменился на сервере, отправка начнётся сначала.")
+            state.update(size=attrs.size or 0, mtime=attrs.mtime, next_part=0, file_ids=[])
+        await send_file_parts(message, sftp, state)
+
+
+async def send_remote_files(message: Message, session: ShellSession, cwd: str, patterns: list[str]):
+    async with session.sftp_client() as sftp:
+        files, errors = await expand_remote_patterns(sftp, cwd, patterns)
+        if len(files) == 1 and not errors:
+            path, _ = files[0]
+            return await send_remote_file(message, sftp, session.server, path, posixpath.basename(path))
+
+        total = sum(size for _, size in files)
+        progress = TransferProgress(message, f"⬇️ Файлов: {len(files)}", total)
+        sent = 0
+        if files and (total > MEDIA_GROUP_MAX_BYTES or len(files) > MEDIA_GROUP_MAX_FILES):
+            # много данных — один архив прямо из tar, в памяти только текущая часть;
+            # считаем сжатые байты, поэтому процент не показываем
+            progress.total = None
+            async def send_part(name: str, part: bytes):
+                await message.answer_document(BufferedInputFile(part, filename=name))
+
+            async with session.channel() as conn:
+                await stream_archive(
+                    conn, "/", send_part,
+                    members=[path.lstrip("/") for path, _ in files], base_name="files", progress=progress,
+                )
+            sent = len(files)
+        elif files:
+            fetched, fetch_errors = await fetch_files(sftp, files, progress)
+            errors += fetch_errors
+            for i in range(0, len(fetched), MEDIA_GROUP_SIZE):
+                group = [
+                    InputMediaDocument(media=BufferedInputFile(content, filename=posixpath.basename(path)))
+                    for path, content in fetched[i:i + MEDIA_GROUP_SIZE]
+                ]
+                if len(group) == 1:
+                    await message.answer_document(group[0].media)
+                else:
+                    await message.answer_media_group(group)
+            sent = len(fetched)
+
+    report = f"✅ Отправлено файлов: {sent} — {progress.summary()}" if sent else "❌ Ни один файл не отправлен."
+    if errors:
+        report += "\n\n⚠️ Ошибки:\n" + "\n".join(errors[:20])
+        if len(errors) > 20:
+            report += f"\n… и ещё {len(errors) - 20}"
+    await progress.finish(report)
+
+
+def clean_output(output: str) -> str:
+    return sanitize(output).strip()
+
+
+async def run_and_reply(message: Message, uid: int, session: ShellSession, cmd: str):
+    data = user_data[uid]
+    timeout = get_timeout(uid)
+    streamer = OutputStreamer(message, reply_markup=interrupt_kb)
+    sanitizer = TerminalSanitizer()
+    record_output(uid, f"$ {cmd}\n")
+
+    async def on_output(chunk: str):
+        record_output(uid, chunk)
+        await streamer.feed(sanitizer.feed(chunk))
+
+    try:
+        result = await session.run(cmd, timeout=timeout, on_output=on_output)
+    except ConnectionError:
+        drop_command_queue(uid)
+        close_browser(uid)
+        await active_sessions.close(uid)
+        data["input_mode"] = False
+        await streamer.finish()
+        return await message.answer("❌ Сессия была прервана. Режим ввода выключен.")
+
+    record_output(uid, result.late_output)
+    record_output(uid, result.output)
+    # «Показать ещё» листает назад от конца вывода этой команды, как и /scrollback
+    scrollback_cursor[uid] = scrollback.store.position(scrollback_key(uid))[1]
+    late = clean_output(result.late_output)
+    if late:
+        await message.answer(f"⏳ Вывод предыдущей команды:\n<pre>{html.escape(late, quote=False)}</pre>", parse_mode="HTML")
+
+    # вывод, не переданный потоком (если ждали хвост предыдущей команды)
+    await streamer.feed(sanitizer.feed(result.output) + sanitizer.flush())
+    if result.timed_out:
+        note = (
+            f"⏳ Команда ещё выполняется (таймаут {timeout:g} с), показан частичный вывод. "
+            "Остальное придёт со следующей командой и попадёт в /scrollback."
+        )
+    elif result.exit_status:
+        note = f"⚠️ Код выхода: {result.exit_status}"
+    else:
+        note = ""
+
+    # команда, не уложившаяся в таймаут, продолжает работать — её ещё можно прервать;
+    # длинный вывод, разошедшийся на несколько сообщений или в файл, можно получить целиком
+    if result.timed_out:
+        markup = interrupt_scrollback_kb
+    elif streamer.total > PAGE_LIMIT:
+        markup = scrollback_kb
+    else:
+        markup = None
+    await streamer.finish(note, reply_markup=markup)
+
+
+def stop_watch(uid: int):
+    watch = watches.pop(uid, None)
+    if watch:
+        watch.stop()
+
+
+def drop_command_queue(uid: int):
+    queue = command_queues.pop(uid, None)
+    if queue:
+        queue.close()
+
+
+async def enqueue_command(message: Message, uid: int, session: ShellSession, cmd: str):
+    # команды одной сессии выполняются строго по очереди, хендлер при этом не ждёт
+    queue = command_queues.get(uid)
+    if queue is None or queue.session is not session:
+        drop_command_queue(uid)
+        queue = command_queues[uid] = CommandQueue(
+            session, lambda msg, command: run_and_reply(msg, uid, session, command)
+        )
+    try:
+        ahead = queue.submit(message, cmd)
+    except QueueFull:
+        return await message.answer(
+            f"🚦 Очередь команд заполнена ({queue.max_depth}), команда не принята. "
+            f"Дождитесь выполнения или прервите текущую.",
+            reply_markup=interrupt_kb,
+        )
+    if ahead:
+        await message.answer(f"⏳ Команда в очереди, перед ней: {ahead}.", reply_markup=interrupt_kb)
+
 # ======== Обработчики ========
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
@@ -82,6 +506,208 @@ async def cmd_start(message: Message):
         }
     await message.answer("Добро пожаловать! Используйте кнопки ниже:", reply_markup=main_kb)
 
+@dp.message(Command("timeout"))
+async def cmd_timeout(message: Message):
+    uid = message.from_user.id
+    data = user_data.get(uid)
+    if not data:
+        return await message.answer("Введите /start, чтобы инициализировать данные.")
+    parts = message.text.split()
+    try:
+        timeout = float(parts[1])
+        if timeout <= 0:
+            raise ValueError
+    except (IndexError, ValueError):
+        return await message.answer(
+            f"Текущий таймаут команды: {get_timeout(uid):g} с.\nПример: /timeout 60"
+        )
+    data["command_timeout"] = timeout
+    await message.answer(f"✅ Таймаут команды: {timeout:g} с.")
+
+@dp.message(Command("watch"))
+async def cmd_watch(message: Message):
+    uid = message.from_user.id
+    session = active_sessions.get(uid)
+    if not session:
+        return await message.answer("⚠️ Сначала включите сессию, чтобы использовать эту функцию.")
+    parts = message.text.split(maxsplit=1)
+    args = parts[1].strip() if len(parts) > 1 else ""
+    interval = WATCH_INTERVAL
+    first, _, rest = args.partition(" ")
+    try:
+        interval = float(first)
+        args = rest.strip()
+    except ValueError:
+        pass
+    if not args or interval <= 0:
+        return await message.answer(
+            "Формат: /watch [секунды] команда\n"
+            f"Пример: /watch 5 df -h\n"
+            f"Сообщение обновляется, только когда вывод меняется; пока он стоит на месте, "
+            f"опрос замедляется до раза в {WATCH_MAX_INTERVAL:g} с."
+        )
+    stop_watch(uid)
+    watch = watches[uid] = Watch(message, session, args, interval=interval, timeout=get_timeout(uid))
+    watch.start()
+
+@dp.callback_query(F.data == "watch_stop")
+async def watch_stop(callback: CallbackQuery):
+    uid = callback.from_user.id
+    watch = watches.get(uid)
+    if not watch or not watch.running:
+        watches.pop(uid, None)
+        return await callback.answer("Наблюдение уже остановлено.")
+    stop_watch(uid)
+    await callback.answer("Наблюдение остановлено.")
+
+@dp.callback_query(F.data == "resume_download")
+async def resume_download_handler(callback: CallbackQuery):
+    uid = callback.from_user.id
+    state = pending_downloads.get(callback.message.chat.id)
+    await callback.answer()
+    if not state:
+        return await callback.message.answer("⛔ Нечего продолжать.")
+    session = active_sessions.get(uid)
+    if not session:
+        return await callback.message.answer("⚠️ Сначала включите сессию, чтобы использовать эту функцию.")
+    if state["server"] != session.server:
+        pending_downloads.pop(callback.message.chat.id, None)
+        return await callback.message.answer("⛔ Передача начиналась с другого сервера, продолжить нельзя.")
+    try:
+        await resume_download(callback.message, session, state)
+    except Exception as e:
+        await callback.message.answer(f"❌ Ошибка: {e}", reply_markup=resume_download_kb)
+
+@dp.message(Command("sync"))
+async def cmd_sync(message: Message):
+    # Скачать директорию, пересылая только то, что изменилось с прошлого /sync этой же
+    # директории: find даёт размеры и mtime, sha256sum на сервере отсеивает файлы, которые
+    # только «потрогали», в архив попадают лишь изменённые. Манифест обновляется после отправки.
+    uid = message.from_user.id
+    session = active_sessions.get(uid)
+    if not session:
+        return await message.answer("⚠️ Сначала включите сессию, чтобы использовать эту функцию.")
+    data = user_data[uid]
+    parts = message.text.split(maxsplit=1)
+    cwd = await current_path(uid)
+    path = posixpath.join(cwd, parts[1].strip()) if len(parts) > 1 else cwd
+    manifests = data.setdefault("sync_manifests", {})
+    key = f"{session.server}:{path}"
+    try:
+        async with session.channel() as conn:
+            changed, manifest, removed = await changed_files(conn, path, manifests.get(key, {}))
+            if not changed:
+                manifests[key] = manifest
+                note = f", удалено на сервере: {len(removed)}" if removed else ""
+                return await message.answer(f"✅ {path}: изменений нет{note}.")
+
+            progress = TransferProgress(message, f"🔄 Синхронизация: {len(changed)} из {len(manifest)}")
+
+            async def send_part(name: str, part: bytes):
+                await message.answer_document(BufferedInputFile(part, filename=name))
+
+            # всё изменилось или список слишком длинный для аргументов tar — архивируем целиком
+            everything = len(changed) == len(manifest) or len(changed) > SYNC_MAX_MEMBERS
+            await stream_archive(
+                conn, path, send_part,
+                members=(".",) if everything else changed, base_name="sync",
+                level=data.get("archive_level"), progress=progress,
+            )
+        # сюда доходим, только если tar и отправка всех частей прошли без ошибок (иначе
+        # ArchiveError или исключение отправки): при сбое старый манифест остаётся и
+        # изменённые файлы уйдут следующим /sync
+        manifests[key] = manifest
+        report = f"✅ {path}: отправлено изменённых файлов: {len(changed)} — {progress.summary()}"
+        if removed:
+            report += f"\n🗑 Удалено на сервере: {len(removed)}"
+        await progress.finish(report)
+    except ArchiveError as e:
+        await message.answer(f"❌ Ошибка архивации:\n{e}")
+    except Exception as e:
+        await message.answer(f"❌ Ошибка синхронизации: {e}")
+
+@dp.message(Command("archive_level"))
+async def cmd_archive_level(message: Message):
+    uid = message.from_user.id
+    data = user_data.get(uid)
+    if not data:
+        return await message.answer("Введите /start, чтобы инициализировать данные.")
+    parts = message.text.split()
+    try:
+        level = int(parts[1])
+    except (IndexError, ValueError):
+        return await message.answer(
+            "Уровень сжатия архивов: gzip 1–9, zstd 1–19, 0 — по умолчанию.\nПример: /archive_level 9"
+        )
+    if level and not any(level in levels for levels in ARCHIVE_LEVELS.values()):
+        return await message.answer("❌ Допустимые уровни: gzip 1–9, zstd 1–19.")
+    data["archive_level"] = level or None
+    await message.answer(f"✅ Уровень сжатия: {level or 'по умолчанию'}")
+
+# ======== Группы хостов и fan-out ========
+@dp.message(Command("group_add"))
+async def cmd_group_add(message: Message):
+    uid = message.from_user.id
+    data = user_data.get(uid)
+    if not data:
+        return await message.answer("Введите /start, чтобы инициализировать данные.")
+    parts = message.text.split(maxsplit=2)
+    if len(parts) < 3:
+        return await message.answer(
+            "Формат: /group_add имя ip,port,username,password; ip,port,username,password …\n"
+            "Хосты можно перечислять через ; или с новой строки."
+        )
+    name = parts[1]
+    try:
+        hosts = parse_hosts(parts[2])
+    except ValueError as e:
+        return await message.answer(f"❌ {e}")
+    groups = data.setdefault("host_groups", {})
+    groups.setdefault(name, []).extend(hosts)
+    await message.answer(f"✅ Группа {name}: {len(groups[name])} хост(ов).")
+
+@dp.message(Command("group_del"))
+async def cmd_group_del(message: Message):
+    uid = message.from_user.id
+    parts = message.text.split()
+    groups = user_data.get(uid, {}).get("host_groups", {})
+    if len(parts) < 2 or parts[1] not in groups:
+        return await message.answer("Формат: /group_del имя (список групп: /groups)")
+    del groups[parts[1]]
+    await message.answer(f"🗑 Группа {parts[1]} удалена.")
+
+@dp.message(Command("groups"))
+async def cmd_groups(message: Message):
+    groups = user_data.get(message.from_user.id, {}).get("host_groups", {})
+    if not groups:
+        return await message.answer("Групп пока нет. Добавьте: /group_add имя ip,port,username,password")
+    lines = [f"{name}: {', '.join(host_label(h) for h in hosts)}" for name, hosts in groups.items()]
+    await message.answer("\n".join(lines))
+
+@dp.message(Command("fanout"))
+async def cmd_fanout(message: Message):
+    uid = message.from_user.id
+    data = user_data.get(uid)
+    if not data:
+        return await message.answer("Введите /start, чтобы инициализировать данные.")
+    parts = message.text.split(maxsplit=2)
+    if len(parts) < 3:
+        return await message.answer("Формат: /fanout группа команда")
+    name, command = parts[1], parts[2]
+    hosts = data.get("host_groups", {}).get(name)
+    if not hosts:
+        return await message.answer(f"❌ Группа {name} не найдена. Список групп: /groups")
+
+    status = await message.answer(f"🚀 {command} → {len(hosts)} хост(ов)…")
+    started = asyncio.get_running_loop().time()
+    results = await fanout(hosts, command, timeout=get_timeout(uid), mux=ssh_mux)
+    wall_time = asyncio.get_running_loop().time() - started
+
+    streamer = OutputStreamer(message, filename=f"fanout_{name}.txt")
+    await streamer.feed(format_summary(command, results, wall_time))
+    await streamer.finish()
+    await status.delete()
+
 @dp.message(F.text == "Пользователь")
 async def user_info(message: Message):
     uid = message.from_user.id
@@ -127,27 +753,11 @@ async def start_download_mode(message: Message):
     if not data.get("input_mode") or uid not in active_sessions:
         return await message.answer("⚠️ Сначала включите сессию, чтобы использовать эту функцию.")
 
-    try:
-        if uid in active_sessions:
-            conn, process = active_sessions[uid]
-            process.stdin.write("pwd\n")
-            await asyncio.sleep(0.1)
-            output = await process.stdout.read(1024)
-            output = re.sub(r'\x1B\].*?(?:\x07|\x1B\\)', '', output)
-            output = re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', output)
-            lines = output.strip().splitlines()
-
-            for line in lines:
-                if line.startswith("/"):
-                    data["current_path"] = line.strip()
-                    break
-    except Exception as e:
-        await message.answer(f"⚠️ Не удалось определить путь: {e}")
-
+    # current_path обновляется сам из потока вывода (хук приглашения в ShellSession)
     data["download_mode"] = True
     await message.answer(
-        f"Скачивание из: {data['current_path']}\n"
-        "Введите имя файла для загрузки:"
+        f"Скачивание из: {await current_path(uid)}\n"
+        "Введите имя файла для загрузки (можно несколько через пробел и шаблоны вроде *.log, имена с пробелами — в кавычках):"
     )
 
 @dp.message(F.text == "Загрузить в текущ. директорию")
@@ -159,29 +769,7 @@ async def start_upload_mode(message: Message):
     if not data.get("input_mode") or uid not in active_sessions:
         return await message.answer("⚠️ Сначала включите сессию, чтобы использовать эту функцию.")
 
-    try:
-        if uid in active_sessions:
-            conn, process = active_sessions[uid]
-
-            # отправляем команду в уже активную сессию PTY
-            process.stdin.write("pwd\n")
-            await asyncio.sleep(0.1)
-            output = await process.stdout.read(1024)
-
-            # чистим от лишнего
-            output = re.sub(r'\x1B\].*?(?:\x07|\x1B\\)', '', output)
-            output = re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', output)
-            lines = output.strip().splitlines()
-
-            for line in lines:
-                if line.startswith("/"):
-                    data["current_path"] = line.strip()
-                    break
-
-        display_path = data.get("current_path", ".")
-    except Exception as e:
-        await message.answer(f"⚠️ Не удалось определить путь: {e}")
-        display_path = data.get("current_path", ".")
+    display_path = await current_path(uid)
 
     data["upload_mode"] = True
     await message.answer(
@@ -199,72 +787,64 @@ async def ask_download_directory(message: Message):
         return await message.answer("⚠️ Сначала включите сессию, чтобы использовать эту функцию.")
 
     try:
-        conn, process = active_sessions[uid]
-        process.stdin.write("pwd\n")
-        await asyncio.sleep(0.1)
-        raw_output = await process.stdout.read(4096)
-        clean = re.sub(r'\x1B\].*?(?:\x07|\x1B\\)', '', raw_output)
-        clean = re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', clean)
-        lines = clean.strip().splitlines()
-
-        # Найдём первую строку, которая начинается с /
-        for line in lines:
-            if line.startswith("/"):
-                path = line.strip()
-                break
-        else:
-            path = data.get("current_path", ".")
-
-        data["current_path"] = path
+        path = await current_path(uid)
 
         # Сохраняем флаг подтверждения
-        data["confirm_dir_download"] = True
+        await pending.set(f"confirm_dir:{uid}", True)
 
-        # Клавиатура подтверждения
+        # Клавиатура подтверждения: выбор сжатия и есть подтверждение
         confirm_kb = InlineKeyboardMarkup(
             inline_keyboard=[
                 [
-                    InlineKeyboardButton(text="✅ Подтвердить", callback_data="confirm_download_dir"),
-                    InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_download_dir"),
-                ]
+                    InlineKeyboardButton(text="✅ gzip", callback_data="confirm_download_dir:gzip"),
+                    InlineKeyboardButton(text="✅ zstd", callback_data="confirm_download_dir:zstd"),
+                    InlineKeyboardButton(text="✅ Без сжатия", callback_data="confirm_download_dir:none"),
+                ],
+                [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_download_dir")],
             ]
         )
 
+        level = data.get("archive_level")
         await message.answer(
-            f"📦 Скачивание директории: <code>{path}</code>\nВы уверены?",
+            f"📦 Скачивание директории: <code>{html.escape(path)}</code>\n"
+            f"Уровень сжатия: {level or 'по умолчанию'} (/archive_level N)\n"
+            "Выберите сжатие для подтверждения:",
             parse_mode="HTML",
             reply_markup=confirm_kb
         )
     except Exception as e:
         await message.answer(f"❌ Ошибка определения пути:\n{e}")
 
-@dp.callback_query(F.data == "confirm_download_dir")
+@dp.callback_query(F.data.startswith("confirm_download_dir"))
 async def confirm_download_dir(callback: CallbackQuery):
     uid = callback.from_user.id
     data = user_data.get(uid)
 
-    if not data.get("confirm_dir_download"):
+    if not await pending.pop(f"confirm_dir:{uid}"):  # проверяем и сразу сбрасываем
         return await callback.answer("⚠️ Запрос на скачивание директории не активен.")
 
-    data["confirm_dir_download"] = False  # сбрасываем
+    codec = callback.data.partition(":")[2] or "gzip"
+    if codec not in ARCHIVE_CODECS:
+        codec = "gzip"
 
     try:
-        conn = active_sessions[uid][0]
+        session = active_sessions[uid]
         current_path = data.get("current_path", ".")
+        progress = TransferProgress(callback.message, "📦 Архивация")
 
-        archive_name = f"/tmp/{uid}_dir.tar.gz"
-
-        # Архивируем через SSH
-        result = await conn.run(f"tar -czf {archive_name} -C '{current_path}' .", check=False)
-        if result.stderr:
-            return await callback.message.answer(f"❌ Ошибка архивации:\n{result.stderr}")
-
-        # Скачиваем через SFTP
-        async with conn.start_sftp_client() as sftp:
-            local_path = f"/tmp/{uid}_download.tar.gz"
-            await sftp.get(archive_name, local_path)
+        async def send_part(name: str, part: bytes):
+            await callback.message.answer_document(BufferedInputFile(part, filename=name))
 
-        await callback.message.answer_document(FSInputFile(local_path, filename="directory.tar.gz"))
+        # tar идёт прямо из exec-канала в Telegram, без архивов в /tmp на обеих сторонах
+        async with session.channel() as conn:
+            parts = await stream_archive(
+                conn, current_path, send_part,
+                codec=codec, level=data.get("archive_level"), progress=progress,
+            )
+        note = f", частей: {parts} (склеить: cat directory* > archive)" if parts > 1 else ""
+        await progress.finish(f"✅ Директория отправлена: {progress.summary()}{note}")
+    except ArchiveError as e:
+        await callback.message.answer(f"❌ Ошибка архивации:\n{e}")
     except Exception as e:
         await callback.message.answer(f"❌ Ошибка при скачивании директории:\n{e}")
     finally:
@@ -274,32 +854,115 @@ async def confirm_download_dir(callback: CallbackQuery):
 @dp.callback_query(F.data == "cancel_download_dir")
 async def cancel_download_dir(callback: CallbackQuery):
     uid = callback.from_user.id
-    user_data[uid]["confirm_dir_download"] = False
+    await pending.pop(f"confirm_dir:{uid}")
     await callback.message.answer("❌ Скачивание директории отменено.")
     await callback.answer()
 
 
+# ======== Проводник ========
+@dp.message(Command("browse"))
+@dp.message(F.text == "Обзор файлов")
+async def open_browser(message: Message):
+    uid = message.from_user.id
+    data = user_data.get(uid, {})
+    session = active_sessions.get(uid)
+    if not data.get("input_mode") or not session:
+        return await message.answer("⚠️ Сначала включите сессию, чтобы использовать эту функцию.")
+    parts = (message.text or "").split(maxsplit=1)
+    path = await current_path(uid)
+    if message.text.startswith("/browse") and len(parts) > 1:
+        path = posixpath.join(path, parts[1].strip())
+    # кэш листингов переживает повторное открытие, пока жива та же сессия
+    browser = browsers.get(uid)
+    if browser is None or browser.session is not session:
+        close_browser(uid)
+        browser = browsers[uid] = FileBrowser(session, path)
+    try:
+        if not path.startswith("/"):
+            async with session.sftp_client() as sftp:
+                path = await sftp.realpath(path)
+        await browser.open(path)
+    except Exception as e:
+        return await message.answer(f"❌ Не удалось открыть {path}: {e}")
+    text, markup = browser.render()
+    browser.message = await message.answer(text, parse_mode="HTML", reply_markup=markup)
+
+@dp.callback_query(F.data.startswith("fb:"))
+async def browser_action(callback: CallbackQuery):
+    uid = callback.from_user.id
+    browser = browsers.get(uid)
+    if not browser or browser.session is not active_sessions.get(uid):
+        return await callback.answer("Проводник закрыт, откройте его заново.")
+    view, _, rest = callback.data[3:].partition(":")
+    action, _, arg = rest.partition(":")
+    # кнопки со старого сообщения или из прежнего списка: номер записи в них уже про другой файл
+    if not view.isdigit() or not browser.is_current(int(view), callback.message):
+        return await callback.answer("Кнопка устарела: список уже изменился.", show_alert=True)
+    entry = browser.entry(int(arg)) if arg.isdigit() and action != "p" else None
+    if arg.isdigit() and action != "p" and entry is None:
+        return await callback.answer("Список устарел, обновите его.", show_alert=True)
+    notice = None
+    try:
+        if action == "noop":
+            return await callback.answer()
+        if action == "x":
+            close_browser(uid)
+            await callback.answer()
+            return await callback.message.edit_reply_markup(reply_markup=None)
+        if action == "p":
+            browser.turn(int(arg))
+        elif action == "up":
+            await browser.up()
+        elif action == "r":
+            await browser.reload()
+        elif action == "b":
+            browser.selected = None
+        elif action == "o":
+            if await browser.resolve(entry):
+                await browser.open(browser.child(entry))
+            else:
+                browser.selected = int(arg)
+        elif action == "rm":
+            await callback.answer()
+            return await browser.show(*browser.render_delete(int(arg)))
+        elif action == "rmok":
+            await browser.delete(entry)
+            notice = f"🗑 {entry.name} удалён"
+        elif action == "d":
+            await callback.answer("⬇️ Отправляю…")
+            async with browser.session.sftp_client() as sftp:
+                await send_remote_file(callback.message, sftp, browser.session.server, browser.child(entry), entry.name)
+            return
+        await browser.show(*browser.render())
+        await callback.answer(notice)
+    except Exception as e:
+        with contextlib.suppress(Exception):
+            await callback.answer()  # мог уже быть отвечен до ошибки
+        await callback.message.answer(f"❌ Ошибка: {e}")
+
+
 @dp.callback_query(F.data == "confirm_upload")
 async def confirm_upload_handler(call: CallbackQuery):
     uid = call.from_user.id
-    data = pending_uploads.pop(uid, None)
+    data = await pending.pop(f"upload:{uid}")
     await call.answer()
 
     if not data:
         return await call.message.answer("⛔ Нечего загружать.")
 
     try:
-        conn = active_sessions[uid][0]
-        async with conn.start_sftp_client() as sftp:
-            await sftp.put(data["local_path"], data["remote_path"])
-        await call.message.answer("✅ Файл успешно заменён.")
+        session = active_sessions[uid]
+        async with session.sftp_client() as sftp:
+            progress = await upload_from_telegram(call.message, session, sftp, data)
+        invalidate_listing(uid, posixpath.dirname(data["remote_path"]))
+        await progress.finish(f"✅ Файл успешно заменён. {progress.summary()}")
     except Exception as e:
-        await call.message.answer(f"❌ Ошибка при загрузке: {e}")
+        await call.message.answer(f"❌ Ошибка при загрузке: {e}{resume_hint(data)}")
 
 @dp.callback_query(F.data == "cancel_upload")
 async def cancel_upload_handler(call: CallbackQuery):
     uid = call.from_user.id
-    data = pending_uploads.pop(uid, None)
+    await pending.pop(f"upload:{uid}")
     await call.answer()
     await call.message.answer("🚫 Загрузка отменена.")
 
@@ -307,7 +970,7 @@ async def cancel_upload_handler(call: CallbackQuery):
 @dp.callback_query(F.data == "force_exec")
 async def force_execute(callback: CallbackQuery):
     uid = callback.from_user.id
-    cmd = pending_commands.pop(uid, None)
+    cmd = await pending.pop(f"command:{uid}")
     await callback.answer()  # убираем «часики»
     if not cmd:
         return await callback.message.answer("Нет команды для выполнения.")
@@ -316,20 +979,78 @@ async def force_execute(callback: CallbackQuery):
     if not session:
         return await callback.message.answer("Сессия закрыта, включите ввод заново.")
 
-    conn, process = session
     # шлём в PTY точно так же, как в основном хендлере:
-    process.stdin.write(cmd + "\n")
-    await asyncio.sleep(0.1)
-    output = await process.stdout.read(65536)
-    # очистка ANSI‑кодов как у вас
-    import re
-    output = re.sub(r'\x1B\].*?(?:\x07|\x1B\\)', '', output)
-    output = re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', output).strip()
-
-    if output:
-        await callback.message.answer(f"<pre>{output}</pre>", parse_mode="HTML")
+    await enqueue_command(callback.message, uid, session, cmd)
+
+
+@dp.callback_query(F.data == "interrupt")
+async def interrupt_command(callback: CallbackQuery):
+    uid = callback.from_user.id
+    session = active_sessions.get(uid)
+    if not session:
+        return await callback.answer("Сессия закрыта.")
+
+    queue = command_queues.get(uid)
+    if queue and queue.session is session:
+        sent, dropped = queue.interrupt()
     else:
-        await callback.message.answer("📥 Команда выполнена, вывода нет.")
+        sent, dropped = session.interrupt(), 0
+    if not sent and not dropped:
+        return await callback.answer("Нечего прерывать.")
+    text = "Ctrl-C отправлен" if sent else "Очередь очищена"
+    note = f", из очереди убрано: {dropped}" if dropped else ""
+    await callback.answer(f"{text}{note}")
+
+@dp.message(Command("scrollback"))
+async def cmd_scrollback(message: Message):
+    uid = message.from_user.id
+    start, total = scrollback.store.position(scrollback_key(uid))
+    if not total:
+        return await message.answer("📜 Буфер прокрутки пуст.")
+    scrollback_cursor[uid] = total
+    dropped = f", из них вытеснено старых: {format_size(start)}" if start else ""
+    await message.answer(f"📜 В буфере {format_size(total - start)} вывода{dropped}.", reply_markup=scrollback_kb)
+
+@dp.callback_query(F.data == "sb_more")
+async def scrollback_more(callback: CallbackQuery):
+    uid = callback.from_user.id
+    key = scrollback_key(uid)
+    start, total = scrollback.store.position(key)
+    cursor = min(scrollback_cursor.get(uid, total), total)
+    if cursor <= start:
+        note = "Более ранний вывод вытеснен из буфера." if start else "Более раннего вывода нет."
+        return await callback.answer(note, show_alert=True)
+    await callback.answer()
+    window = SCROLLBACK_PAGE
+    while True:
+        data, first = scrollback.store.read(key, max(start, cursor - window), cursor)
+        # начало окна могло попасть в середину UTF-8 символа
+        while data and data[0] & 0xC0 == 0x80:
+            data, first = data[1:], first + 1
+        text = sanitize(data.decode(errors="replace"))
+        if escaped_len(text) <= PAGE_LIMIT or window <= 256:
+            break
+        window //= 2
+    scrollback_cursor[uid] = first
+    header = "📜 Ранее:" if first > start else "📜 Начало буфера:"
+    body = f"<pre>{html.escape(text.strip(), quote=False)}</pre>" if text.strip() else "(пусто)"
+    await callback.message.answer(
+        f"{header}\n{body}", parse_mode="HTML",
+        reply_markup=scrollback_kb if first > start else None,
+    )
+
+@dp.callback_query(F.data == "sb_file")
+async def scrollback_file(callback: CallbackQuery):
+    uid = callback.from_user.id
+    data, first = scrollback.store.read(scrollback_key(uid))
+    if not data:
+        return await callback.answer("Буфер прокрутки пуст.", show_alert=True)
+    await callback.answer()
+    text = sanitize(data.decode(errors="replace"))
+    caption = f"Начало вывода ({format_size(first)}) вытеснено из буфера." if first else None
+    await callback.message.answer_document(
+        BufferedInputFile(text.encode(), filename="scrollback.txt"), caption=caption,
+    )
 
 
 
@@ -364,6 +1085,10 @@ async def process_new_data_or_continue(message: Message):
             "current_path": cp,
             "download_mode": dl,
             "upload_mode": ul,
+            "command_timeout": old.get("command_timeout", COMMAND_TIMEOUT),
+            "archive_level": old.get("archive_level"),
+            "host_groups": old.get("host_groups", {}),
+            "sync_manifests": old.get("sync_manifests", {}),
         }
         return await message.answer("✅ Данные обновлены!", reply_markup=main_kb)
 
@@ -374,31 +1099,39 @@ async def process_new_data_or_continue(message: Message):
         # Если пытаемся включить ввод — проверяем SSH-подключение
         if text == "Сессия: Выкл⛔":
             try:
-                conn = await asyncssh.connect(
-                    data["ip"],
-                    port=int(data["port"]),
-                    username=data["username"],
-                    password=data["password"],
-                    known_hosts=None
+                credentials = (data["ip"], int(data["port"]), data["username"], data["password"])
+                lease = await ssh_mux.acquire(*credentials)
+                try:
+                    # создаём интерактивный shell (PTY) на общем соединении
+                    process = await lease.conn.create_process(term_type="xterm")
+                except BaseException:
+                    lease.release()
+                    raise
+                session = ShellSession(
+                    lease, process, on_cwd=path_tracker(uid),
+                    open_channel=lambda: ssh_mux.acquire(*credentials),
+                    server=f"{credentials[0]}:{credentials[1]}",
                 )
-                # создаём интерактивный shell (PTY)
-                process = await conn.create_process(term_type="xterm")
-                active_sessions[uid] = (conn, process)
+                try:
+                    await session.start()
+                except BaseException:
+                    await session.close()
+                    raise
+                await active_sessions.add(uid, session)
+                # у новой сессии свой буфер прокрутки
+                scrollback.store.drop(scrollback_key(uid))
+                scrollback_cursor.pop(uid, None)
                 data["input_mode"] = True
                 new_text = "Сессия: Вкл✅"
             except Exception as e:
                 return await message.answer(f"❌ Ошибка SSH-подключения:\n{e}")
         else:
             # выключаем ввод и закрываем соединение
-            conn = active_sessions.pop(uid, None)
-            if conn:
-                conn, process = active_sessions.pop(uid, (None, None))
-                if process:
-                    process.stdin.write("exit\n")
-                    await process.wait_closed()
-                if conn:
-                    conn.close()
-                data["input_mode"] = False
+            drop_command_queue(uid)
+            stop_watch(uid)
+            close_browser(uid)
+            await active_sessions.close(uid)
+            data["input_mode"] = False
             new_text = "Сессия: Выкл⛔"
 
         return await message.answer(
@@ -409,17 +1142,14 @@ async def process_new_data_or_continue(message: Message):
     # === загрузка и скачивание ===
     # Если мы в режиме скачивания, и получил не документ, а имя файла:
     if data.get("download_mode"):
-        filename = message.text.strip()
         data["download_mode"] = False
-
         try:
-            conn, _ = active_sessions[uid]
-            async with conn.start_sftp_client() as sftp:
-                remote_path = f"{data['current_path'].rstrip('/')}/{filename}"
-                local = f"/tmp/{uid}_{filename}"
-                await sftp.get(remote_path, local)
+            patterns = shlex.split(message.text)
+        except ValueError:
+            patterns = message.text.split()
 
-            await message.answer_document(FSInputFile(path=local, filename=filename))
+        try:
+            await send_remote_files(message, active_sessions[uid], data["current_path"], patterns)
         except Exception as e:
             await message.answer(f"❌ Ошибка: {e}")
         return
@@ -430,30 +1160,33 @@ async def process_new_data_or_continue(message: Message):
         data["upload_mode"] = False  # сбрасываем режим в начале
         uid = message.from_user.id
         file_name = message.document.file_name
+        file_size = message.document.file_size or 0
 
-        # Сохраняем документ во временный файл
-        try:
-            downloaded = await bot.download(message.document)
-            local_path = f"/tmp/{uid}_{file_name}"
-            with open(local_path, "wb") as f:
-                f.write(downloaded.read())
-        except Exception as e:
-            return await message.answer(f"❌ Ошибка при загрузке файла: {e}")
+        if file_size > TELEGRAM_DOWNLOAD_LIMIT:
+            return await message.answer(
+                f"❌ Telegram не отдаёт ботам файлы больше {format_size(TELEGRAM_DOWNLOAD_LIMIT)}."
+            )
 
         # Проверяем существование на сервере
+        upload = None
         try:
-            conn, _ = active_sessions[uid]
-            async with conn.start_sftp_client() as sftp:
+            session = active_sessions[uid]
+            async with session.sftp_client() as sftp:
                 remote_path = f"{data['current_path'].rstrip('/')}/{file_name}"
+                upload = {
+                    "file_id": message.document.file_id,
+                    "file_unique_id": message.document.file_unique_id,
+                    "file_size": file_size,
+                    "remote_path": remote_path,
+                    "file_name": file_name
+                }
 
                 try:
-                    await sftp.stat(remote_path)  # Проверка: существует ли файл?
-                    # Если существует — спрашиваем подтверждение
-                    pending_uploads[uid] = {
-                        "local_path": local_path,
-                        "remote_path": remote_path,
-                        "file_name": file_name
-                    }
+                    attrs = await sftp.stat(remote_path)  # Проверка: существует ли файл?
+                    if await is_same_file(session, upload, attrs.size):
+                        return await message.answer(f"✅ На сервере уже такой же файл `{file_name}`, загрузка не нужна.")
+                    # Если существует — спрашиваем подтверждение; сам файл пока остаётся в Telegram
+                    await pending.set(f"upload:{uid}", upload)
                     await message.answer(
                         f"⚠️ Файл `{file_name}` уже существует. Заменить?",
                         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -465,11 +1198,12 @@ async def process_new_data_or_continue(message: Message):
                     )
                 except asyncssh.SFTPNoSuchFile:
                     # Файл не существует — сразу загружаем
-                    await sftp.put(local_path, remote_path)
-                    await message.answer("✅ Файл загружен.")
+                    progress = await upload_from_telegram(message, session, sftp, upload)
+                    invalidate_listing(uid, posixpath.dirname(remote_path))
+                    await progress.finish(f"✅ Файл загружен. {progress.summary()}")
 
         except Exception as e:
-            await message.answer(f"❌ Ошибка при загрузке: {e}")
+            await message.answer(f"❌ Ошибка при загрузке: {e}{resume_hint(upload) if upload else ''}")
 
         return
 
@@ -485,13 +1219,18 @@ async def process_new_data_or_continue(message: Message):
             data["input_mode"] = False
             return await message.answer("❌ Сессия была прервана. Режим ввода выключен.")
 
-        conn, process = session
         cmd = message.text.strip()
 
         # ——— Проверка на опасные команды ———
         cmd_name = cmd.split()[0]
-        if cmd_name in BLACKLIST and uid not in pending_commands:
-            pending_commands[uid] = cmd
+        if cmd_name in BLACKLIST and await pending.get(f"command:{uid}") is None:
+            await pending.set(f"command:{uid}", cmd)
+            if cmd_name in WATCH_HINTS:
+                return await message.answer(
+                    "⚠️ Интерактивный монитор в чате не работает. "
+                    f"Для наблюдения используйте: /watch {WATCH_HINTS[cmd_name]}",
+                    reply_markup=force_exec_kb
+                )
             return await message.answer(
                 "⚠️ Лучше не использовать эту команду здесь, "
                 "интерфейс редактора не адаптирован под чат. "
@@ -499,39 +1238,25 @@ async def process_new_data_or_continue(message: Message):
                 reply_markup=force_exec_kb
             )
 
-        # 1) Если это cd — отправляем в PTY и затем делаем pwd для уточнения
-        is_cd = cmd.startswith("cd ")
-
-        process.stdin.write(cmd + "\n")
-        await asyncio.sleep(0.1)
-
-        # 2) Читаем вывод после основной команды
-        output = await process.stdout.read(65536)
-        output = re.sub(r'\x1B\].*?(?:\x07|\x1B\\)', '', output)
-        output = re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', output).strip()
-
-        # 3) Если это была команда cd, узнаем pwd и обновим current_path
-        if is_cd:
-            process.stdin.write("pwd\n")
-            await asyncio.sleep(0.1)
-            pwd_output = await process.stdout.read(65536)
-            pwd_output = re.sub(r'\x1B\].*?(?:\x07|\x1B\\)', '', pwd_output)
-            pwd_output = re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', pwd_output).strip()
+        return await enqueue_command(message, uid, session, cmd)
 
-            # Уточняем текущую директорию
-            if pwd_output:
-                data["current_path"] = pwd_output
 
-        # 4) Отправляем ответ пользователю
-        if output:
-            return await message.answer(f"<pre>{output}</pre>", parse_mode="HTML")
-        else:
-            return await message.answer("📥 Команда выполнена. Вывода нет.")
+# ======== Запуск ========
+async def shutdown():
+    # при остановке бота закрываем все SSH-соединения, а не бросаем их
+    await active_sessions.close_all()
+    await ssh_mux.close_all()
+    await pending.close()
 
 
-# ======== Запуск ========
 async def main():
-    await dp.start_polling(bot)
+    # один процесс с long polling; несколько воркеров за webhook — см. webhook.py
+    active_sessions.start()
+    metrics.start_exporter()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
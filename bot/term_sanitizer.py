@@ -0,0 +1,130 @@
+import re
+
+# Полные escape-последовательности
+_ESCAPE_RE = re.compile(
+    r"\x1b\[[0-?]*[ -/]*[@-~]"             # CSI: цвета, перемещения курсора
+    r"|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"  # OSC: заголовок окна, cwd и т.п.
+    r"|\x1b[PX^_][^\x1b]*\x1b\\"           # DCS / SOS / PM / APC
+    r"|\x1b[ -/]*[0-~]"                    # остальные: ESC ( B, ESC =, ESC 7 …
+)
+# Начало последовательности, которая ещё не закончилась в этом куске
+_INCOMPLETE_RE = re.compile(r"\x1b(?:\][^\x07\x1b]*|\[[0-?]*[ -/]*|[PX^_][^\x1b]*|[ -/]*)")
+_UNTERMINATED_STRING_RE = re.compile(r"\x1b(?:\][^\x07\x1b]*|[PX^_][^\x1b]*)")
+# управляющие символы, кроме \b \t \n \r; str.translate на порядок быстрее re.sub по классу символов
+_CONTROL_TABLE = dict.fromkeys([*range(0x00, 0x08), 0x0b, 0x0c, *range(0x0e, 0x20), 0x7f])
+_CURSOR_RE = re.compile(r"([\r\b])")
+
+MAX_PENDING = 4096    # незавершённая последовательность длиннее этого считается мусором
+MAX_LINE = 64 * 1024  # строка без \n длиннее этого отдаётся как есть
+
+
+def _incomplete_start(data: str):
+    esc = data.rfind("\x1b")
+    if esc < 0:
+        return None
+    tail = data[esc:]
+    if tail == "\x1b":
+        # одиночный ESC может быть началом ST (ESC \) для строки OSC/DCS перед ним
+        prev = data.rfind("\x1b", 0, esc)
+        if prev >= 0 and _UNTERMINATED_STRING_RE.fullmatch(data, prev, esc):
+            return prev
+        return esc
+    if _INCOMPLETE_RE.fullmatch(tail):
+        return esc
+    return None
+
+
+def _overwrite(line: str, cursor: int, segment: str):
+    # применяет к строке текст с \r (в начало строки) и \b (на символ назад)
+    if "\b" not in segment and cursor == len(line):
+        # частый случай — прогресс-бар: каждый кусок после \r пишется с начала строки
+        first, *rest = segment.split("\r")
+        line += first
+        for piece in rest:
+            line = piece + line[len(piece):]
+        return line, len(rest[-1]) if rest else len(line)
+    for piece in _CURSOR_RE.split(segment):
+        if piece == "\r":
+            cursor = 0
+        elif piece == "\b":
+            cursor = max(cursor - 1, 0)
+        elif piece:
+            line = line[:cursor] + piece + line[cursor + len(piece):]
+            cursor += len(piece)
+    return line, cursor
+
+
+def _render_lines(text: str) -> str:
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        if "\r" in line or "\b" in line:
+            lines[i] = _overwrite("", 0, line)[0]
+    return "\n".join(lines)
+
+
+# Потоковая очистка вывода терминала: принимает куски в том виде, в каком их отдаёт
+# stdout.read(), и возвращает чистый текст. Escape-последовательности, разрезанные
+# между кусками, дожидаются продолжения; \r и \b переписывают текущую строку, поэтому
+# незаконченная строка придерживается до \n или flush().
+class TerminalSanitizer:
+    def __init__(self):
+        self._pending = ""  # сырой хвост: незавершённая последовательность или \r перед возможным \n
+        self._line = ""     # текущая (незаконченная) строка после отрисовки
+        self._cursor = 0
+
+    def feed(self, chunk: str) -> str:
+        data = self._pending + chunk if self._pending else chunk
+        self._pending = ""
+        start = _incomplete_start(data)
+        if start is not None:
+            if len(data) - start <= MAX_PENDING:
+                self._pending = data[start:]
+            data = data[:start]
+        if data.endswith("\r"):
+            self._pending = "\r" + self._pending
+            data = data[:-1]
+
+        if "\x1b" in data:
+            data = _ESCAPE_RE.sub("", data)
+        if "\r\n" in data:
+            data = data.replace("\r\n", "\n")
+        data = data.translate(_CONTROL_TABLE)
+
+        if "\r" not in data and "\b" not in data and self._cursor == len(self._line):
+            text = self._line + data
+            newline = text.rfind("\n") + 1
+            self._line = text[newline:]
+            self._cursor = len(self._line)
+            out = text[:newline]
+        else:
+            out = self._render(data)
+
+        if len(self._line) > MAX_LINE:
+            out += self._line
+            self._line, self._cursor = "", 0
+        return out
+
+    def _render(self, data: str) -> str:
+        first = data.find("\n")
+        if first < 0:
+            self._line, self._cursor = _overwrite(self._line, self._cursor, data)
+            return ""
+        last = data.rfind("\n")
+        line, _ = _overwrite(self._line, self._cursor, data[:first])
+        # целые строки в середине отрисовываем независимо, трогая только те, где есть \r или \b
+        middle = _render_lines(data[first + 1:last + 1])
+        self._line, self._cursor = _overwrite("", 0, data[last + 1:])
+        return line + "\n" + middle
+
+    def flush(self) -> str:
+        # конец потока: незавершённые последовательности выбрасываем, строку отдаём
+        out = self._line
+        self._pending, self._line, self._cursor = "", "", 0
+        return out
+
+    def clean(self, text: str) -> str:
+        return self.feed(text) + self.flush()
+
+
+def sanitize(text: str) -> str:
+    return TerminalSanitizer().clean(text)
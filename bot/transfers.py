@@ -0,0 +1,328 @@
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Callable
+
+import aiofiles
+from aiogram import Bot
+from asyncssh import FILEXFER_TYPE_DIRECTORY
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InputFile, Message
+
+import metrics
+
+BLOCK_SIZE = 256 * 1024  # размер одного SFTP-запроса
+MAX_REQUESTS = 8         # одновременно висящих SFTP-запросов на файл
+PROGRESS_INTERVAL = 2.0  # как часто обновлять сообщение о прогрессе
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024    # Bot API: отправка файлов
+TELEGRAM_DOWNLOAD_LIMIT = 20 * 1024 * 1024  # Bot API: скачивание файлов ботом
+# Скачивание из Telegram идёт со скоростью записи на SFTP, а timeout у stream_content —
+# на весь запрос, поэтому он считается от размера файла по самой медленной ожидаемой скорости
+STREAM_TIMEOUT = 60
+STREAM_MIN_RATE = 32 * 1024  # байт/с
+
+
+def format_size(size: float) -> str:
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+# Прогресс передачи: одно сообщение, которое правится не чаще PROGRESS_INTERVAL
+class TransferProgress:
+    def __init__(self, message: Message | None, title: str, total: int | None = None):
+        self.message = message
+        self.title = title
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        self._status: Message | None = None
+        self._last_report = self.started
+        self._task: asyncio.Task | None = None
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.monotonic() - self.started, 1e-6)
+
+    @property
+    def rate(self) -> float:
+        return self.done / self.elapsed
+
+    def summary(self) -> str:
+        return f"{format_size(self.done)} за {self.elapsed:.1f} с, {format_size(self.rate)}/с"
+
+    def _text(self) -> str:
+        if self.total:
+            percent = self.done * 100 // self.total
+            return (f"{self.title}: {percent}% ({format_size(self.done)} из {format_size(self.total)}), "
+                    f"{format_size(self.rate)}/с")
+        return f"{self.title}: {format_size(self.done)}, {format_size(self.rate)}/с"
+
+    def update(self, size: int):
+        self.done += size
+        now = time.monotonic()
+        if self.message is None or now - self._last_report < PROGRESS_INTERVAL:
+            return
+        if self._task and not self._task.done():
+            return
+        self._last_report = now
+        self._task = asyncio.create_task(self._show(self._text()))
+
+    async def _show(self, text: str):
+        try:
+            if self._status is None:
+                self._status = await self.message.answer(text)
+            else:
+                await self._status.edit_text(text)
+        except (TelegramBadRequest, TelegramRetryAfter):
+            # прогресс — не главное, пропущенное обновление не страшно
+            pass
+
+    async def finish(self, text: str):
+        if self._task and not self._task.done():
+            await self._task
+        if self._status is not None:
+            await self._show(text)
+        elif self.message is not None:
+            await self.message.answer(text)
+
+
+async def telegram_chunks(bot: Bot, file_id: str, chunk_size: int = BLOCK_SIZE) -> AsyncIterator[bytes]:
+    # Поток байтов файла из Telegram без промежуточного BytesIO и временных файлов
+    file = await bot.get_file(file_id)
+    with metrics.track(metrics.transfer_seconds, "telegram_download", op="telegram_download"):
+        if bot.session.api.is_local:
+            async with aiofiles.open(file.file_path, "rb") as f:
+                while chunk := await f.read(chunk_size):
+                    metrics.transfer_bytes.inc(len(chunk), op="telegram_download")
+                    yield chunk
+            return
+        url = bot.session.api.file_url(bot.token, file.file_path)
+        timeout = STREAM_TIMEOUT + (file.file_size or TELEGRAM_DOWNLOAD_LIMIT) // STREAM_MIN_RATE
+        async for chunk in bot.session.stream_content(
+            url=url, timeout=timeout, chunk_size=chunk_size, raise_for_status=True,
+        ):
+            metrics.transfer_bytes.inc(len(chunk), op="telegram_download")
+            yield chunk
+
+
+async def _rechunk(source: AsyncIterator[bytes], size: int) -> AsyncIterator[bytes]:
+    buffer = bytearray()
+    async for chunk in source:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+async def stream_to_sftp(
+    sftp,
+    source: AsyncIterator[bytes],
+    remote_path: str,
+    progress: TransferProgress | None = None,
+    block_size: int = BLOCK_SIZE,
+    max_requests: int = MAX_REQUESTS,
+    start: int = 0,
+    on_commit: Callable[[int], None] | None = None,
+) -> int:
+    # Конвейерная запись: каждый блок пишется по своему смещению, одновременно висит до
+    # max_requests запросов, так что в памяти не больше max_requests * block_size байт.
+    # start > 0 — дозапись существующего файла, source тогда начинается с этого смещения.
+    # on_commit получает длину непрерывно записанного начала файла: блоки завершаются
+    # не по порядку, и только до этой границы файл точно не содержит дыр.
+    slots = asyncio.Semaphore(max_requests)
+    pending: set[asyncio.Task] = set()
+    errors: list[Exception] = []
+    offset = committed = start
+    finished: dict[int, int] = {}  # начало завершённого блока -> его конец
+
+    async def write(f, data: bytes, at: int):
+        nonlocal committed
+        try:
+            await f.write(data, at)
+            if progress:
+                progress.update(len(data))
+            finished[at] = at + len(data)
+            while committed in finished:
+                committed = finished.pop(committed)
+            if on_commit:
+                on_commit(committed)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            slots.release()
+
+    with metrics.track(metrics.transfer_seconds, "sftp_put", op="sftp_put"):
+        async with sftp.open(remote_path, "r+b" if start else "wb") as f:
+            try:
+                async for block in _rechunk(source, block_size):
+                    await slots.acquire()
+                    if errors:
+                        slots.release()
+                        raise errors[0]
+                    task = asyncio.create_task(write(f, block, offset))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                    offset += len(block)
+                if pending:
+                    await asyncio.gather(*pending)
+                if errors:
+                    raise errors[0]
+                if start:
+                    # хвост от прежней, более длинной попытки не должен остаться в файле
+                    await f.truncate(offset)
+            except Exception:
+                # источник оборвался — уже отправленные блоки дописываем, чтобы они вошли
+                # в подтверждённое начало и не качались заново при повторе
+                if pending:
+                    await asyncio.gather(*pending, return_exceptions=True)
+                raise
+            except BaseException:
+                for task in pending:
+                    task.cancel()
+                raise
+    metrics.transfer_bytes.inc(offset - start, op="sftp_put")
+    return offset
+
+
+async def sftp_chunks(
+    sftp,
+    remote_path: str,
+    progress: TransferProgress | None = None,
+    block_size: int = BLOCK_SIZE,
+    max_requests: int = MAX_REQUESTS,
+    start: int = 0,
+    length: int | None = None,
+) -> AsyncIterator[bytes]:
+    # Чтение с упреждением: до max_requests блоков запрашиваются параллельно,
+    # а наружу отдаются строго по порядку. start/length — читать только кусок файла.
+    with metrics.track(metrics.transfer_seconds, "sftp_get", op="sftp_get"):
+        async with sftp.open(remote_path, "rb") as f:
+            size = (await f.stat()).size or 0
+            if length is not None:
+                size = min(size, start + length)
+            offsets = iter(range(start, max(size, start + 1), block_size))
+            window: deque[tuple[int, asyncio.Task]] = deque()
+
+            def request(at: int):
+                window.append((at, asyncio.create_task(f.read(block_size, at))))
+
+            try:
+                for offset in offsets:
+                    request(offset)
+                    if len(window) >= max_requests:
+                        break
+                while window:
+                    offset, task = window.popleft()
+                    data = await task
+                    next_offset = next(offsets, None)
+                    if next_offset is not None:
+                        request(next_offset)
+                    # сервер вправе вернуть меньше запрошенного — добираем остаток блока
+                    expected = min(block_size, size - offset)
+                    while data and len(data) < expected:
+                        more = await f.read(expected - len(data), offset + len(data))
+                        if not more:
+                            break
+                        data += more
+                    if not data:
+                        continue
+                    if progress:
+                        progress.update(len(data))
+                    metrics.transfer_bytes.inc(len(data), op="sftp_get")
+                    yield data
+                # файл мог вырасти после stat — дочитываем хвост последовательно
+                offset = max(size, 0)
+                while length is None and (data := await f.read(block_size, offset)):
+                    offset += len(data)
+                    if progress:
+                        progress.update(len(data))
+                    metrics.transfer_bytes.inc(len(data), op="sftp_get")
+                    yield data
+            finally:
+                for _, task in window:
+                    task.cancel()
+
+
+# Файл на сервере как InputFile для aiogram: байты идут из SFTP прямо в запрос к Bot API
+class SFTPInputFile(InputFile):
+    def __init__(self, sftp, remote_path: str, filename: str, progress: TransferProgress | None = None,
+                 start: int = 0, length: int | None = None):
+        super().__init__(filename=filename, chunk_size=BLOCK_SIZE)
+        self.sftp = sftp
+        self.remote_path = remote_path
+        self.progress = progress
+        self.start = start
+        self.length = length
+
+    async def read(self, bot: Bot) -> AsyncIterator[bytes]:
+        async for chunk in sftp_chunks(self.sftp, self.remote_path, self.progress,
+                                       start=self.start, length=self.length):
+            yield chunk
+
+
+MAX_PARALLEL_FILES = 4  # файлов, читаемых по SFTP одновременно
+GLOB_CHARS = set("*?[")
+
+
+async def expand_remote_patterns(sftp, cwd: str, patterns: list[str]):
+    # Раскрывает имена и glob-шаблоны относительно cwd на стороне сервера.
+    # Возвращает [(путь, размер)] только для обычных файлов и список ошибок по шаблонам.
+    files: dict[str, int] = {}
+    errors: list[str] = []
+    slots = asyncio.Semaphore(MAX_PARALLEL_FILES * 4)
+
+    def absolute(pattern: str) -> str:
+        return pattern if pattern.startswith("/") else f"{cwd.rstrip('/')}/{pattern}"
+
+    async def stat(path: str):
+        async with slots:
+            try:
+                attrs = await sftp.stat(path)
+            except Exception as e:
+                errors.append(f"{path}: {e}")
+                return
+        if attrs.type == FILEXFER_TYPE_DIRECTORY:
+            errors.append(f"{path}: это директория")
+        else:
+            files[path] = attrs.size or 0
+
+    paths: list[str] = []
+    for pattern in patterns:
+        if GLOB_CHARS & set(pattern):
+            try:
+                matches = await sftp.glob(absolute(pattern))
+            except Exception as e:
+                errors.append(f"{pattern}: {e}")
+                continue
+            if not matches:
+                errors.append(f"{pattern}: нет совпадений")
+            paths.extend(matches)
+        else:
+            paths.append(absolute(pattern))
+
+    await asyncio.gather(*(stat(path) for path in dict.fromkeys(paths)))
+    return sorted(files.items()), errors
+
+
+async def fetch_files(sftp, files: list[tuple[str, int]], progress: TransferProgress | None = None,
+                      max_parallel: int = MAX_PARALLEL_FILES):
+    # Параллельно читает файлы в память (не больше max_parallel одновременно).
+    # Ошибка одного файла не прерывает остальные.
+    slots = asyncio.Semaphore(max_parallel)
+    results: dict[str, bytes] = {}
+    errors: list[str] = []
+
+    async def fetch(path: str):
+        async with slots:
+            try:
+                results[path] = b"".join([chunk async for chunk in sftp_chunks(sftp, path, progress)])
+            except Exception as e:
+                errors.append(f"{path}: {e}")
+
+    await asyncio.gather(*(fetch(path) for path, _ in files))
+    return [(path, results[path]) for path, _ in files if path in results], errors
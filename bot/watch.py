@@ -0,0 +1,126 @@
+import asyncio
+import html
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from output_streamer import EDIT_INTERVAL, split_page
+from term_sanitizer import sanitize
+
+WATCH_INTERVAL = 2.0      # секунд между запусками, пока вывод меняется
+WATCH_MAX_INTERVAL = 30.0  # до скольких растягивается интервал, пока вывод стоит на месте
+WATCH_BACKOFF = 1.5
+WATCH_TTL = 10 * 60        # через сколько наблюдение останавливается само
+WATCH_PAGE_LIMIT = 3500    # символов вывода в сообщении, остальное обрезается
+
+watch_stop_kb = InlineKeyboardMarkup(
+    inline_keyboard=[[InlineKeyboardButton(text="⏹ Остановить", callback_data="watch_stop")]]
+)
+
+
+# Замена top/htop и ручным повторам df -h: команда периодически выполняется в отдельном
+# exec-канале (не в PTY сессии), а одно сообщение правится, только если очищенный вывод
+# изменился. Пока вывод не меняется, интервал растёт до WATCH_MAX_INTERVAL, при изменении
+# возвращается к исходному, а TelegramRetryAfter поднимает нижнюю границу — так и запросы
+# к Bot API, и нагрузка на сервер зависят от того, как часто меняется вывод.
+class Watch:
+    def __init__(
+        self,
+        message: Message,
+        session,
+        command: str,
+        interval: float = WATCH_INTERVAL,
+        ttl: float = WATCH_TTL,
+        timeout: float = 30.0,
+    ):
+        self.message = message
+        self.session = session
+        self.command = command
+        self.base_interval = max(interval, EDIT_INTERVAL)
+        self.interval = self.base_interval
+        self.ttl = ttl
+        self.timeout = timeout
+        self.runs = 0
+        self.edits = 0
+        self._status: Message | None = None
+        self._shown = ""
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def _poll(self) -> str:
+        async with self.session.channel() as conn:
+            result = await asyncio.wait_for(conn.run(self.command, check=False), self.timeout)
+        output = sanitize(f"{result.stdout or ''}{result.stderr or ''}").rstrip()
+        if result.exit_status:
+            output += f"\n⚠️ Код выхода: {result.exit_status}"
+        return output
+
+    def _render(self, output: str, footer: str) -> str:
+        page, rest = split_page(output, WATCH_PAGE_LIMIT)
+        body = html.escape(page, quote=False) + ("\n…" if rest else "")
+        return f"👁 <code>{html.escape(self.command, quote=False)}</code>\n<pre>{body or ' '}</pre>\n{footer}"
+
+    async def _show(self, text: str, reply_markup=None):
+        if text == self._shown:
+            return
+        while True:
+            try:
+                if self._status is None:
+                    self._status = await self.message.answer(text, parse_mode="HTML", reply_markup=reply_markup)
+                else:
+                    await self._status.edit_text(text, parse_mode="HTML", reply_markup=reply_markup)
+                break
+            except TelegramRetryAfter as e:
+                # Telegram просит реже — это становится новым нижним пределом интервала
+                self.base_interval = max(self.base_interval, float(e.retry_after))
+                self.interval = max(self.interval, self.base_interval)
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    raise
+                break
+        self._shown = text
+        self.edits += 1
+
+    async def _loop(self):
+        deadline = time.monotonic() + self.ttl
+        last_output = None
+        reason = "истекло время наблюдения"
+        try:
+            while time.monotonic() < deadline:
+                try:
+                    output = await self._poll()
+                except asyncio.TimeoutError:
+                    output = f"⏳ Команда не уложилась в {self.timeout:g} с"
+                self.runs += 1
+                if output != last_output:
+                    last_output = output
+                    self.interval = self.base_interval
+                    footer = f"🔄 {time.strftime('%H:%M:%S')}, каждые {self.base_interval:g} с"
+                    await self._show(self._render(output, footer), watch_stop_kb)
+                else:
+                    # вывод не меняется — опрашиваем реже
+                    self.interval = min(self.interval * WATCH_BACKOFF, WATCH_MAX_INTERVAL)
+                await asyncio.sleep(min(self.interval, max(deadline - time.monotonic(), 0)))
+        except asyncio.CancelledError:
+            reason = "остановлено"
+            raise
+        except Exception as e:
+            reason = f"ошибка: {e}"
+        finally:
+            footer = f"⏹ {reason} (запусков: {self.runs}, обновлений: {self.edits})"
+            try:
+                await asyncio.shield(self._show(self._render(last_output or "", footer)))
+            except Exception:
+                pass
+
+    def stop(self):
+        if self.running:
+            self._task.cancel()
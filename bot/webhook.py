@@ -0,0 +1,294 @@
+# Режим webhook с несколькими процессами бота.
+#
+# Telegram шлёт обновления на один адрес — его слушает приёмник (Ingress). Он не разбирает
+# обновление целиком: достаёт id пользователя и пересылает исходное тело одному из воркеров,
+# выбранному по согласованному хэшированию. Воркер — обычный telegram_bot со своими SSH-сессиями
+# и webhook-обработчиком aiogram на 127.0.0.1. Все обновления пользователя попадают на один и
+# тот же воркер, поэтому его PTY, очередь команд и кэши живут в памяти этого процесса, а при
+# изменении числа воркеров переезжает только ~1/N пользователей. Если воркер не отвечает,
+# обновление уходит следующему по кольцу; подтверждения при этом не теряются, потому что
+# лежат в общем хранилище (shared_state.py, с RCMU_REDIS_URL — в redis).
+#
+# Запуск: RCMU_WEBHOOK_URL=https://example.com/webhook python bot/webhook.py
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, web
+
+WEBHOOK_URL = os.environ.get("RCMU_WEBHOOK_URL")  # публичный адрес, который получит Telegram
+WEBHOOK_SECRET = os.environ.get("RCMU_WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.environ.get("RCMU_WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("RCMU_WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = "/webhook"
+WORKERS = int(os.environ.get("RCMU_BOT_WORKERS", str(os.cpu_count() or 1)))
+WORKER_BASE_PORT = int(os.environ.get("RCMU_WORKER_BASE_PORT", "8600"))
+WORKER_PATH = "/update"
+RING_REPLICAS = 128       # точек на кольце на воркер: чем больше, тем ровнее делятся пользователи
+FORWARD_TIMEOUT = 10
+WORKER_RETRY = 5.0        # секунд не слать воркеру, который не ответил
+WORKER_START_TIMEOUT = 30
+SUPERVISE_INTERVAL = 1.0
+
+
+def _hash(value) -> int:
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes, replicas: int = RING_REPLICAS):
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._keys = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def nodes_for(self, key):
+        # узлы в порядке обхода кольца от точки ключа: первый — хозяин, дальше — запасные
+        start = bisect.bisect(self._keys, _hash(key))
+        seen = set()
+        for i in range(len(self._nodes)):
+            node = self._nodes[(start + i) % len(self._nodes)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+    def node_for(self, key):
+        return next(self.nodes_for(key))
+
+
+def update_user_id(update: dict) -> int:
+    # у всех типов обновлений автор лежит в from (или user у poll_answer), иначе берём чат
+    for value in update.values():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+            chat = value.get("chat")
+            if isinstance(chat, dict) and "id" in chat:
+                return chat["id"]
+    return update.get("update_id", 0)
+
+
+# ======== Воркер ========
+def run_worker(index: int, host: str, port: int):
+    asyncio.run(_worker(index, host, port))
+
+
+async def _worker(index: int, host: str, port: int):
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+    import telegram_bot as tb
+
+    users: set[int] = set()
+    handled = 0
+
+    @tb.dp.update.outer_middleware()
+    async def count_updates(handler, event, data):
+        nonlocal handled
+        handled += 1
+        user = data.get("event_from_user")
+        if user:
+            users.add(user.id)
+        return await handler(event, data)
+
+    async def stats(request):
+        return web.json_response({
+            "worker": index, "pid": os.getpid(), "updates": handled, "users": sorted(users),
+            "sessions": tb.active_sessions.stats()["open_sessions"], "ssh": tb.ssh_mux.stats(),
+        })
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=tb.dp, bot=tb.bot, handle_in_background=True).register(app, path=WORKER_PATH)
+    app.router.add_get("/stats", stats)
+
+    tb.active_sessions.start()
+    tb.metrics.start_exporter(tb.metrics.EXPORTER_PORT + 1 + index)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await tb.shutdown()
+        await tb.bot.session.close()
+
+
+# ======== Приёмник ========
+class Ingress:
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        host: str = WEBHOOK_HOST,
+        port: int = WEBHOOK_PORT,
+        base_port: int = WORKER_BASE_PORT,
+        secret: str = WEBHOOK_SECRET,
+        worker_target=run_worker,
+    ):
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.worker_target = worker_target
+        self.ring = HashRing(range(workers))
+        self.ports = {i: base_port + i for i in range(workers)}
+        self.processes: dict[int, multiprocessing.Process] = {}
+        self.forwarded = {i: 0 for i in range(workers)}
+        self.rerouted = 0
+        self.rejected = 0
+        self._down_until: dict[int, float] = {}
+        self._ctx = multiprocessing.get_context("spawn")
+        self._session: ClientSession | None = None
+        self._runner: web.AppRunner | None = None
+        self._supervisor: asyncio.Task | None = None
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(
+            target=self.worker_target, args=(index, "127.0.0.1", self.ports[index]),
+            name=f"bot-worker-{index}", daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def _wait_ready(self, index: int):
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while True:
+            try:
+                async with self._session.get(f"http://127.0.0.1:{self.ports[index]}/stats") as resp:
+                    if resp.status == 200:
+                        return
+            except ClientError:
+                pass
+            if time.monotonic() > deadline or not self.processes[index].is_alive():
+                raise RuntimeError(f"воркер {index} не запустился")
+            await asyncio.sleep(0.1)
+
+    async def _supervise(self):
+        # упавший воркер перезапускается на том же порту, а пока его нет — работают запасные
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            for index, process in list(self.processes.items()):
+                if not process.is_alive():
+                    logging.warning("воркер %s завершился (код %s), перезапуск", index, process.exitcode)
+                    self._spawn(index)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            self.rejected += 1
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400)
+        now = time.monotonic()
+        for attempt, node in enumerate(self.ring.nodes_for(update_user_id(update))):
+            if self._down_until.get(node, 0) > now:
+                continue
+            try:
+                async with self._session.post(
+                    f"http://127.0.0.1:{self.ports[node]}{WORKER_PATH}",
+                    data=body, headers={"Content-Type": "application/json"},
+                ) as resp:
+                    if resp.status < 500:
+                        self.forwarded[node] += 1
+                        self.rerouted += attempt > 0
+                        return web.Response()
+            except (ClientError, asyncio.TimeoutError):
+                pass
+            self._down_until[node] = now + WORKER_RETRY
+        # ни один воркер не принял — Telegram повторит доставку сам
+        return web.Response(status=503)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        workers = []
+        for index, port in self.ports.items():
+            try:
+                async with self._session.get(f"http://127.0.0.1:{port}/stats") as resp:
+                    workers.append(await resp.json())
+            except ClientError as e:
+                workers.append({"worker": index, "error": str(e)})
+        return web.json_response({
+            "forwarded": self.forwarded, "rerouted": self.rerouted, "rejected": self.rejected, "workers": workers,
+        })
+
+    async def start(self):
+        self._session = ClientSession(
+            connector=TCPConnector(limit=0), timeout=ClientTimeout(total=FORWARD_TIMEOUT),
+        )
+        for index in self.ports:
+            self._spawn(index)
+        await asyncio.gather(*(self._wait_ready(index) for index in self.ports))
+        self._supervisor = asyncio.create_task(self._supervise())
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle)
+        app.router.add_get("/stats", self.stats)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        if not self.port:
+            self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._supervisor:
+            self._supervisor.cancel()
+        if self._runner:
+            await self._runner.cleanup()
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            await asyncio.to_thread(process.join, 10)
+            if process.is_alive():
+                process.kill()
+        if self._session:
+            await self._session.close()
+
+
+async def set_webhook(url: str, secret: str):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    from botToken import TOKEN
+
+    api = os.environ.get("RCMU_TELEGRAM_API")
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api)) if api else None)
+    try:
+        await bot.set_webhook(url, secret_token=secret or None)
+    finally:
+        await bot.session.close()
+
+
+async def main():
+    if not WEBHOOK_URL:
+        sys.exit("Укажите публичный адрес: RCMU_WEBHOOK_URL=https://…/webhook")
+    ingress = Ingress()
+    await ingress.start()
+    await set_webhook(WEBHOOK_URL, WEBHOOK_SECRET)
+    logging.info("webhook: %s → :%s, воркеров: %s", WEBHOOK_URL, ingress.port, len(ingress.ports))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await ingress.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(main())
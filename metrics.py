@@ -0,0 +1,228 @@
+# Метрики для веб-части и бота: счётчики, гистограммы и gauge в формате Prometheus.
+#
+# Включаются переменной окружения RCMU_METRICS=1. Выключенные метрики — пустышки,
+# у которых inc/observe/time ничего не делают, так что стоимость в горячем пути — один
+# вызов пустого метода. Веб-приложение отдаёт их на /metrics, бот — через start_exporter().
+import contextlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get("RCMU_METRICS", "").lower() in ("1", "true", "yes", "on")
+EXPORTER_PORT = int(os.environ.get("RCMU_METRICS_PORT", "9464"))
+# по умолчанию только локально: метрики выдают число сессий и нагрузку, наружу — явно
+EXPORTER_HOST = os.environ.get("RCMU_METRICS_HOST", "127.0.0.1")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# секунды: от быстрого exec до долгой передачи файла
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple, list] = {}  # метки -> [счётчики по корзинам..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(row)) for key, row in self._values.items())
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = _labels(self.labelnames, key, f'le="{bound:g}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {row[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(row[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {row[-1]}")
+        return lines
+
+
+# Текущее значение. Либо задаётся через set(), либо считается при каждой выдаче метрик
+# функцией collect, которая возвращает {значения меток: число}. collect вызывается из потока
+# экспортёра, поэтому должна читать только снимки общих структур.
+class Gauge:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.collect = collect
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.collect is not None:
+            items = sorted(self.collect().items())
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items)
+        return lines
+
+
+class _Noop:
+    def inc(self, amount: float = 1, **labels):
+        pass
+
+    def set(self, value: float, **labels):
+        pass
+
+    def observe(self, value: float, **labels):
+        pass
+
+    def time(self, **labels):
+        return contextlib.nullcontext()
+
+
+_NOOP = _Noop()
+_metrics: dict[str, Counter | Histogram | Gauge] = {}
+
+
+def counter(name: str, help: str, labelnames: tuple = ()):
+    if not ENABLED:
+        return _NOOP
+    return _metrics.setdefault(name, Counter(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+    if not ENABLED:
+        return _NOOP
+    return _metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+
+def gauge(name: str, help: str, labelnames: tuple = (), collect=None):
+    if not ENABLED:
+        return _NOOP
+    return _metrics.setdefault(name, Gauge(name, help, labelnames, collect))
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ======== Общие метрики обоих фронтендов ========
+# frontend: "web" (paramiko) или "bot" (asyncssh); op — вид операции
+ssh_connect_seconds = histogram(
+    "rcmu_ssh_connect_seconds", "SSH handshake: TCP, key exchange and auth", ("frontend",))
+ssh_command_seconds = histogram(
+    "rcmu_ssh_command_seconds", "Remote command round trip", ("frontend", "mode"))
+transfer_seconds = histogram(
+    "rcmu_transfer_seconds", "Duration of one SFTP, archive or Telegram file transfer", ("op",))
+transfer_bytes = counter(
+    "rcmu_transfer_bytes_total", "Bytes moved by transfers and command output", ("op",))
+telegram_request_seconds = histogram(
+    "rcmu_telegram_request_seconds", "Bot API request duration", ("method",))
+errors = counter(
+    "rcmu_errors_total", "Failed operations by kind", ("op", "error"))
+
+
+@contextlib.contextmanager
+def track(hist, kind: str, **labels):
+    # время операции в hist, а при исключении — rcmu_errors_total{op=kind}
+    with hist.time(**labels):
+        try:
+            yield
+        except GeneratorExit:
+            # досрочно закрытый генератор (потребителю хватило данных) — не ошибка
+            raise
+        except BaseException as e:
+            errors.inc(op=kind, error=type(e).__name__)
+            raise
+
+
+class _ExporterHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exporter(port: int = EXPORTER_PORT, host: str = EXPORTER_HOST) -> ThreadingHTTPServer | None:
+    # отдельный HTTP-сервер в фоновом потоке — для процессов без своего веб-сервера (бот)
+    if not ENABLED:
+        return None
+    server = ThreadingHTTPServer((host, port), _ExporterHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
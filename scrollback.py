@@ -0,0 +1,127 @@
+# Буфер прокрутки для веб-терминала и бота: последние байты вывода каждой сессии.
+#
+# У каждой сессии кольцевой буфер фиксированной ёмкости: новый вывод затирает самый старый,
+# так что сессия с бесконечным выводом (tail -f, yes) не съедает память. Память под буфер
+# выделяется по мере заполнения, а общий бюджет на процесс ограничивает сумму всех буферов:
+# при превышении целиком выбрасываются буферы сессий, в которые дольше всего не писали.
+# Смещения абсолютные — сколько байт сессия вывела с начала, поэтому по ним можно листать
+# назад и понимать, какая часть уже вытеснена.
+import os
+import threading
+from collections import OrderedDict
+
+SCROLLBACK_CAPACITY = int(os.environ.get("RCMU_SCROLLBACK_KB", "256")) * 1024
+SCROLLBACK_BUDGET = int(os.environ.get("RCMU_SCROLLBACK_BUDGET_MB", "64")) * 1024 * 1024
+
+
+class RingBuffer:
+    def __init__(self, capacity: int = SCROLLBACK_CAPACITY):
+        self.capacity = capacity
+        self.total = 0           # байт записано за всё время
+        self._data = bytearray()  # растёт до capacity, дальше пишется по кругу
+        self._pos = 0             # куда пойдёт следующий байт, когда буфер заполнен
+
+    @property
+    def start(self) -> int:
+        # смещение самого старого байта, который ещё хранится
+        return self.total - len(self._data)
+
+    @property
+    def size(self) -> int:
+        return len(self._data)
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        self.total += len(data)
+        if len(data) >= self.capacity:
+            self._data = bytearray(data[-self.capacity:])
+            self._pos = 0
+            return
+        free = self.capacity - len(self._data)
+        if free:
+            head = data[:free]
+            self._data += head
+            data = data[len(head):]
+            if not data:
+                return
+        end = self._pos + len(data)
+        if end <= self.capacity:
+            self._data[self._pos:end] = data
+        else:
+            split = self.capacity - self._pos
+            self._data[self._pos:] = data[:split]
+            self._data[:end - self.capacity] = data[split:]
+        self._pos = end % self.capacity
+
+    def read(self, start: int | None = None, end: int | None = None) -> bytes:
+        # байты в абсолютных смещениях [start, end), обрезанные тем, что ещё хранится
+        start = self.start if start is None else max(start, self.start)
+        end = self.total if end is None else min(end, self.total)
+        if start >= end:
+            return b""
+        ordered = self._data[self._pos:] + self._data[:self._pos] if self._pos else self._data
+        base = self.start
+        return bytes(ordered[start - base:end - base])
+
+    def tail(self, size: int) -> bytes:
+        return self.read(self.total - size)
+
+
+class ScrollbackStore:
+    def __init__(self, budget: int = SCROLLBACK_BUDGET, capacity: int = SCROLLBACK_CAPACITY):
+        self.budget = budget
+        self.capacity = capacity
+        self.evicted = 0
+        self._buffers: OrderedDict[str, RingBuffer] = OrderedDict()  # от давно не писавших к свежим
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def write(self, key: str, data: bytes):
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = RingBuffer(self.capacity)
+            else:
+                self._buffers.move_to_end(key)
+            before = buffer.size
+            buffer.write(data)
+            self._used += buffer.size - before
+            while self._used > self.budget and len(self._buffers) > 1:
+                _, oldest = self._buffers.popitem(last=False)
+                self._used -= oldest.size
+                self.evicted += 1
+
+    def read(self, key: str, start: int | None = None, end: int | None = None) -> tuple[bytes, int]:
+        # (данные, абсолютное смещение их начала); для неизвестной сессии — (b"", 0)
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                return b"", 0
+            start = buffer.start if start is None else max(start, buffer.start)
+            return buffer.read(start, end), start
+
+    def tail(self, key: str, size: int) -> bytes:
+        with self._lock:
+            buffer = self._buffers.get(key)
+            return buffer.tail(size) if buffer else b""
+
+    def position(self, key: str) -> tuple[int, int]:
+        # (самое старое хранимое смещение, сколько записано всего)
+        with self._lock:
+            buffer = self._buffers.get(key)
+            return (buffer.start, buffer.total) if buffer else (0, 0)
+
+    def drop(self, key: str):
+        with self._lock:
+            buffer = self._buffers.pop(key, None)
+            if buffer:
+                self._used -= buffer.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"buffers": len(self._buffers), "bytes": self._used, "budget": self.budget, "evicted": self.evicted}
+
+
+# один на процесс: бюджет общий для всех сессий веб-части или бота
+store = ScrollbackStore()
@@ -1,11 +1,218 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
 import paramiko
 
-def run_ssh_command(host, username, password, command):
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(host, username=username, password=password)
-    stdin, stdout, stderr = ssh.exec_command(command)
-    output = stdout.read().decode()
-    error = stderr.read().decode()
-    ssh.close()
-    return output, error
+import metrics
+
+
+# ======== Пул SSH-соединений ========
+# Рукопожатие (TCP + обмен ключами + аутентификация) стоит намного дороже самой команды,
+# поэтому аутентифицированные транспорты переиспользуются, а на каждую команду
+# открывается только новый канал.
+class SSHConnectionPool:
+    def __init__(self, max_size=16, idle_timeout=300, keepalive_interval=30, connect_timeout=10):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()  # key: (client, last_used)
+        self._channels = {}  # key: открытые поверх транспорта каналы (PTY, exec)
+        self._opening = {}   # key: сколько потоков сейчас открывают на нём канал
+
+    @staticmethod
+    def make_key(host, port, username, password):
+        # пароль в ключе храним только в виде хэша
+        secret = hashlib.sha256((password or "").encode()).hexdigest()
+        return host, int(port), username, secret
+
+    def _connect(self, host, port, username, password):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        with metrics.track(metrics.ssh_connect_seconds, "ssh_connect", frontend="web"):
+            client.connect(
+                host,
+                port=int(port),
+                username=username,
+                password=password,
+                timeout=self.connect_timeout,
+                banner_timeout=self.connect_timeout,
+                auth_timeout=self.connect_timeout,
+                look_for_keys=False,
+                allow_agent=False,
+            )
+        client.get_transport().set_keepalive(self.keepalive_interval)
+        return client
+
+    @staticmethod
+    def _is_alive(client):
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _in_use(self, key):
+        # вызывается под self._lock; каналы, закрытые сервером, уже не считаются, а транспорт,
+        # на котором канал только открывается, занят — иначе его вытеснят до open_session
+        if self._opening.get(key):
+            return True
+        channels = self._channels.get(key)
+        if channels:
+            channels.difference_update([c for c in channels if c.closed])
+        return bool(channels)
+
+    def _evict_idle(self):
+        # вызывается под self._lock; транспорт с живыми каналами (веб-терминал, отсоединённый
+        # шелл) простаивающим не считается
+        now = time.monotonic()
+        expired = [
+            k for k, (_, used) in self._clients.items()
+            if now - used > self.idle_timeout and not self._in_use(k)
+        ]
+        return [self._clients.pop(k)[0] for k in expired]
+
+    def _evict_overflow(self, keep=None):
+        # вызывается под self._lock; LRU, но только среди транспортов без открытых каналов.
+        # Если заняты все, пул временно больше max_size и ужимается, когда закроется канал
+        evicted = []
+        for key in list(self._clients):
+            if len(self._clients) <= self.max_size:
+                break
+            if key != keep and not self._in_use(key):
+                evicted.append(self._clients.pop(key)[0])
+        return evicted
+
+    def _checkout(self, key, channel):
+        with self._lock:
+            self._channels.setdefault(key, set()).add(channel)
+        close = channel.close
+
+        def checkin():
+            try:
+                close()
+            finally:
+                self._checkin(key, channel)
+
+        channel.close = checkin
+
+    def _checkin(self, key, channel):
+        with self._lock:
+            evicted = self._release(key, channel)
+        for old in evicted:
+            old.close()
+
+    def _release(self, key, channel):
+        # вызывается под self._lock
+        channels = self._channels.get(key)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self._channels[key]
+        entry = self._clients.get(key)
+        if entry:
+            # простой отсчитывается от закрытия последнего канала, а не от открытия
+            self._clients[key] = (entry[0], time.monotonic())
+            self._clients.move_to_end(key)
+        return self._evict_overflow()
+
+    def _discard(self, key, client):
+        with self._lock:
+            current = self._clients.get(key)
+            if current and current[0] is client:
+                del self._clients[key]
+        client.close()
+
+    def acquire(self, host, port, username, password):
+        key = self.make_key(host, port, username, password)
+        with self._lock:
+            stale = self._evict_idle()
+            entry = self._clients.get(key)
+            if entry:
+                self._clients.move_to_end(key)
+        for client in stale:
+            client.close()
+
+        if entry and self._is_alive(entry[0]):
+            client = entry[0]
+        else:
+            if entry:
+                self._discard(key, entry[0])
+            client = self._connect(host, port, username, password)
+
+        evicted = []
+        with self._lock:
+            current = self._clients.get(key)
+            if current and current[0] is not client and self._is_alive(current[0]):
+                # параллельный поток успел подключиться раньше — используем его соединение
+                evicted.append(client)
+                client = current[0]
+            self._clients[key] = (client, time.monotonic())
+            self._clients.move_to_end(key)
+            evicted.extend(self._evict_overflow(keep=key))
+        for old in evicted:
+            old.close()
+        return key, client
+
+    def open_channel(self, host, port, username, password):
+        # новый канал поверх пулового транспорта; если транспорт умер — переподключаемся один раз
+        key = self.make_key(host, port, username, password)
+        with self._lock:
+            self._opening[key] = self._opening.get(key, 0) + 1
+        try:
+            for attempt in range(2):
+                key, client = self.acquire(host, port, username, password)
+                try:
+                    channel = client.get_transport().open_session(timeout=self.connect_timeout)
+                except (paramiko.SSHException, EOFError, OSError, AttributeError):
+                    self._discard(key, client)
+                    if attempt:
+                        raise
+                    continue
+                self._checkout(key, channel)
+                return channel
+        finally:
+            with self._lock:
+                self._opening[key] -= 1
+                if not self._opening[key]:
+                    del self._opening[key]
+
+    def open_shell(self, host, port, username, password, term="xterm", cols=80, rows=24):
+        # интерактивный PTY-канал поверх пулового транспорта
+        channel = self.open_channel(host, port, username, password)
+        try:
+            channel.get_pty(term=term, width=cols, height=rows)
+            channel.invoke_shell()
+        except Exception:
+            channel.close()
+            raise
+        return channel
+
+    def exec_command(self, host, port, username, password, command, timeout=None):
+        # timeout — на чтение вывода: зависшая команда не должна навсегда занимать поток
+        with metrics.track(metrics.ssh_command_seconds, "ssh_exec", frontend="web", mode="exec"):
+            channel = self.open_channel(host, port, username, password)
+            try:
+                channel.settimeout(timeout)
+                channel.exec_command(command)
+                stdout = channel.makefile("rb").read()
+                stderr = channel.makefile_stderr("rb").read()
+            finally:
+                channel.close()
+        metrics.transfer_bytes.inc(len(stdout) + len(stderr), op="exec_output")
+        return stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+    def close_all(self):
+        with self._lock:
+            clients = [c for c, _ in self._clients.values()]
+            self._clients.clear()
+            self._channels.clear()
+        for client in clients:
+            client.close()
+
+
+pool = SSHConnectionPool()
+
+
+def run_ssh_command(host, username, password, command, port=22, timeout=None):
+    return pool.exec_command(host, port, username, password, command, timeout=timeout)
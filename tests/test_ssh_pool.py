@@ -0,0 +1,64 @@
+# Пул SSH-соединений веб-части против локального fake_ssh_server: транспорты с открытыми
+# каналами (веб-терминалы) не вытесняются ни по простою, ни по размеру пула.
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "benchmarks"))
+sys.path.insert(0, str(ROOT))
+
+from fake_ssh_server import FakeSSHServer  # noqa: E402
+from ssh_utils import SSHConnectionPool  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def server():
+    with tempfile.TemporaryDirectory() as workdir, FakeSSHServer(workdir) as srv:
+        yield srv
+
+
+def creds(server, host="127.0.0.1"):
+    c = server.credentials
+    return host, c["port"], c["username"], c["password"]
+
+
+def shell_alive(channel):
+    channel.sendall(b"echo alive\n")
+    deadline = time.monotonic() + 5
+    data = b""
+    while b"alive\n" not in data and time.monotonic() < deadline:
+        if channel.recv_ready():
+            data += channel.recv(4096)
+        else:
+            time.sleep(0.05)
+    return b"alive\n" in data
+
+
+def test_full_pool_of_busy_transports_accepts_new_key(server):
+    pool = SSHConnectionPool(max_size=1)
+    try:
+        shell = pool.open_shell(*creds(server))
+        # второй ключ (другой host) при заполненном занятом пуле
+        assert pool.exec_command(*creds(server, "localhost"), "echo hi", timeout=5) == ("hi\n", "")
+        assert shell_alive(shell)
+        shell.close()
+        # канал закрыт — пул снова ужимается до max_size
+        assert len(pool._clients) == 1
+    finally:
+        pool.close_all()
+
+
+def test_idle_eviction_keeps_transport_with_open_shell(server):
+    pool = SSHConnectionPool(idle_timeout=0.5)
+    try:
+        shell = pool.open_shell(*creds(server))
+        time.sleep(1)
+        pool.exec_command(*creds(server, "localhost"), "true", timeout=5)
+        assert shell_alive(shell)
+        shell.close()
+    finally:
+        pool.close_all()